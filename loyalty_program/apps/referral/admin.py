@@ -1,5 +1,26 @@
 from django.contrib import admin
-from .models import Client, Referral
+from .models import Client, PointTransaction, Referral, ReferralArchive
+
+
+@admin.register(PointTransaction)
+class PointTransactionAdmin(admin.ModelAdmin):
+    """
+    The ledger is append-only: the admin can browse it, but neither add,
+    change nor delete a transaction, which would drift from Client.points.
+    """
+    list_display = ('client', 'amount', 'reason', 'referral_id', 'created_at')
+    list_filter = ('reason',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 
 admin.site.register(Client)
 admin.site.register(Referral)
+admin.site.register(ReferralArchive)
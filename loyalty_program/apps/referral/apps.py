@@ -1,6 +1,29 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ReferralConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'loyalty_program.apps.referral'
+
+    def ready(self):
+        # connects the signals that invalidate the caches, keep the
+        # membership filters up to date and tune the SQLite connections
+        from . import cache, database, membership  # noqa: F401
+
+
+def start_background_jobs():
+    """
+    Starts the background threads of the app. It's called by the WSGI and
+    ASGI entry points, so they only run on the processes that serve
+    requests, and not on the management commands (migrate, test, shell...)
+    nor on the autoreloader process of runserver.
+    """
+    from .membership import client_cpfs, referred_cpfs
+    client_cpfs.start_build()
+    referred_cpfs.start_build()
+
+    interval = getattr(settings, 'REFERRAL_SWEEP_INTERVAL', None)
+    if interval:
+        from .sweeper import start_sweeper
+        start_sweeper(interval)
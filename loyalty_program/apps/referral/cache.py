@@ -0,0 +1,198 @@
+"""
+Read caches of the API responses, on any django cache backend (locmem by
+default).
+
+The serialized clients served by /user/<cpf>/ are cached on the cache set
+by settings.CLIENT_CACHE_ALIAS, keyed by a version of the client. The
+version is replaced when the client is saved and when its points or
+referral counters are updated with UPDATE queries (and again once the
+transaction commits), so a profile is read from the database once per
+change, and a read that ran before a write stores its payload under the
+old version, where nobody looks it up.
+
+The responses of the referral listings are cached on the cache set by
+settings.REFERRAL_CACHE_ALIAS, keyed by a generation: every referral
+belongs to the generation of its referrer and to the global one, and a
+write replaces them with new ones, so all the responses that may include the referral
+become unreachable at once, without looking them up. The generations are
+kept on the database (ReferralGeneration) and replaced in the write's
+transaction, so a write in one process invalidates the responses cached by
+all of them, even on a process-local cache; a cached response costs a
+primary key lookup of its generation.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from hashlib import md5
+import threading
+import uuid
+
+from .models import Client, Referral, ReferralGeneration
+
+
+class CountedCache:
+    """
+    Base of the caches, with the hit and miss counters of this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, payload):
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return payload
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else None}
+
+
+class ClientCache(CountedCache):
+    """
+    Version-keyed cache of the full JSON payload of each client.
+    """
+
+    @property
+    def cache(self):
+        return caches[settings.CLIENT_CACHE_ALIAS]
+
+    @staticmethod
+    def version_key(cpf):
+        cpf = Client._meta.get_field('cpf').to_python(cpf)
+        return f'referral:client-version:{cpf}'
+
+    def version(self, cpf):
+        """
+        The current version of the client, created if it doesn't exist (or
+        was evicted).
+        """
+        key = self.version_key(cpf)
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, uuid.uuid4().hex, None)
+            version = self.cache.get(key)
+        return version
+
+    def key(self, cpf):
+        """
+        Key of a client payload, which must be taken before the database is
+        read, so a payload read before a write is never stored under the
+        version that comes after it.
+        """
+        cpf = Client._meta.get_field('cpf').to_python(cpf)
+        return f'referral:client:{cpf}:{self.version(cpf)}'
+
+    def get(self, key):
+        return self.count(self.cache.get(key))
+
+    def set(self, key, payload):
+        self.cache.set(key, payload, settings.CLIENT_CACHE_TIMEOUT)
+
+    def invalidate(self, cpfs):
+        """
+        Moves the given clients to new versions, now and again once the
+        current transaction commits. Versions are random, so concurrent
+        invalidations never end on the same value.
+        """
+        keys = [self.version_key(cpf) for cpf in cpfs]
+
+        def replace():
+            self.cache.set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+        if keys:
+            replace()
+            transaction.on_commit(replace)
+
+
+class ReferralCache(CountedCache):
+    """
+    Generation-versioned cache of the responses of the referral listings.
+    A scope is the CPF of a referrer, or ALL for the listings that may
+    include any referral.
+    """
+
+    ALL = 'all'
+
+    @property
+    def cache(self):
+        return caches[settings.REFERRAL_CACHE_ALIAS]
+
+    @staticmethod
+    def scope(cpf):
+        """
+        The scope of a referrer, given its CPF in any format.
+        """
+        return Client._meta.get_field('cpf').to_python(cpf)
+
+    @staticmethod
+    def generation(scope):
+        """
+        The current generation of the scope, empty before its first write.
+        """
+        return ReferralGeneration.objects.filter(scope=scope).values_list(
+            'generation', flat=True).first() or ''
+
+    def key(self, endpoint, scope, arguments):
+        """
+        Key of a response, which must be taken before the database is read,
+        so a response read before a write is never stored under the
+        generation that comes after it.
+        """
+        digest = md5(arguments.encode()).hexdigest()
+        return f'referral:response:{endpoint}:{scope}:{self.generation(scope)}:{digest}'
+
+    def get(self, key):
+        return self.count(self.cache.get(key))
+
+    def set(self, key, payload):
+        self.cache.set(key, payload, settings.REFERRAL_CACHE_TIMEOUT)
+
+    def bump(self, source_cpfs):
+        """
+        Moves the given referrers, and the global scope, to a new generation,
+        with one UPDATE on the current transaction, so it's seen together
+        with the write that caused it. Generations are random, so they never
+        come back, even after a rollback. The scopes written for the first
+        time get their rows before.
+        """
+        scopes = {self.ALL, *(self.scope(cpf) for cpf in source_cpfs)}
+        generation = uuid.uuid4().hex
+        generations = ReferralGeneration.objects.filter(scope__in=scopes)
+        if generations.update(generation=generation) < len(scopes):
+            ReferralGeneration.objects.bulk_create(
+                [ReferralGeneration(scope=scope, generation=generation) for scope in scopes],
+                ignore_conflicts=True)
+            generations.update(generation=generation)
+
+
+client_cache = ClientCache()
+referral_cache = ReferralCache()
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_saved_client(sender, instance, **kwargs):
+    client_cache.invalidate([instance.cpf])
+
+
+@receiver(post_save, sender=Referral)
+def invalidate_saved_referral(sender, instance, created, **kwargs):
+    # a new referral is counted with update_referral_counters, which bumps
+    if not created:
+        referral_cache.bump([instance.source_cpf_id])
+
+
+@receiver(post_delete, sender=Client)
+def invalidate_deleted_referrer(sender, instance, **kwargs):
+    # the referrals of the client are deleted with it, without signals
+    referral_cache.bump([instance.cpf])
@@ -0,0 +1,50 @@
+"""
+Conditional GET support. The ETag and Last-Modified validators are derived
+from the `updated_at` of the returned object (or the latest one, for lists),
+so a client that already has the current version gets a 304 Not Modified
+from a single-column query, without the row being loaded or serialized.
+"""
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def is_conditional(request):
+    """
+    Whether the request has a validator to be checked.
+    """
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def make_etag(updated_at, variant=''):
+    """
+    Weak ETag from the update time, in microseconds. `variant` tells apart
+    the representations of the same version (like the requested fields).
+    """
+    version = f'{int(updated_at.timestamp() * 1_000_000):x}'
+    return f'W/"{version}{"-" + variant if variant else ""}"'
+
+
+def not_modified(request, updated_at, variant=''):
+    """
+    Returns a 304 response if the validators of the request match the
+    version of the object, or None if the full response is needed.
+    """
+    if updated_at is None:
+        return None
+    response = get_conditional_response(
+        request, etag=make_etag(updated_at, variant),
+        last_modified=int(updated_at.timestamp()))
+    if response is not None:
+        add_validators(response, updated_at, variant)
+    return response
+
+
+def add_validators(response, updated_at, variant=''):
+    """
+    Sets the ETag and Last-Modified headers of a response. Last-Modified
+    only has seconds, so the ETag is the exact validator.
+    """
+    if updated_at is not None:
+        response['ETag'] = make_etag(updated_at, variant)
+        response['Last-Modified'] = http_date(updated_at.timestamp())
+    return response
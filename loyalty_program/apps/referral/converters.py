@@ -0,0 +1,16 @@
+from .fields import normalize_cpf
+
+
+class CPFConverter:
+    """
+    URL path converter for CPFs, with or without punctuation
+    ('00011122233' or '000.111.222-33'). Anything else is a 404.
+    """
+
+    regex = r'\d{3}\.?\d{3}\.?\d{3}-?\d{2}'
+
+    def to_python(self, value):
+        return normalize_cpf(value)
+
+    def to_url(self, value):
+        return normalize_cpf(value)
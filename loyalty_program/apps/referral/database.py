@@ -0,0 +1,87 @@
+"""
+SQLite tuning. Every new SQLite connection gets the pragmas of
+settings.SQLITE_PRAGMAS: with the write-ahead log (journal_mode=WAL) readers
+don't block the writer nor the writer the readers, synchronous=NORMAL only
+syncs the log on checkpoints, busy_timeout makes a connection wait for a
+lock instead of failing at once, and mmap_size, cache_size and temp_store
+keep more of the database in memory.
+
+SQLite still has a single writer, and a deferred transaction that reads
+before writing fails right away with "database is locked" when another
+connection wrote in the meantime, whatever the busy timeout. The write
+views are wrapped in `retry_when_locked`, which runs them again after an
+exponential backoff, and the bulk import of clients, which commits chunk
+by chunk, retries each chunk with `retry_outside_transaction`.
+"""
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from functools import wraps
+import random
+import sqlite3
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def apply_pragmas(connection, pragmas):
+    """
+    Runs `PRAGMA name = value` on a DB-API SQLite connection for each item.
+    """
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def tune_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        apply_pragmas(connection.connection, getattr(settings, 'SQLITE_PRAGMAS', {}))
+
+
+def is_lock_error(error):
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+def retry_on_lock(call, attempts=None, backoff=None):
+    """
+    Returns the result of `call`, running it again while it fails because
+    the database is locked, up to `attempts` times in total. The waits
+    start at `backoff` seconds and double each time, with jitter, so the
+    retrying writers don't collide again.
+    """
+    attempts = attempts or settings.SQLITE_LOCK_RETRIES
+    backoff = settings.SQLITE_LOCK_BACKOFF if backoff is None else backoff
+    for attempt in range(attempts):
+        try:
+            return call()
+        except (OperationalError, sqlite3.OperationalError) as error:
+            if not is_lock_error(error) or attempt == attempts - 1:
+                raise
+            delay = backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.warning("Database is locked, retrying in %.3fs.", delay)
+            time.sleep(delay)
+
+
+def retry_outside_transaction(call):
+    """
+    Returns the result of `call`, retried with `retry_on_lock`. It isn't
+    retried inside an outer transaction, which the failed statement leaves
+    unusable.
+    """
+    if transaction.get_connection().in_atomic_block:
+        return call()
+    return retry_on_lock(call)
+
+
+def retry_when_locked(method):
+    """
+    Decorator of a view method that writes, which retries it with
+    `retry_outside_transaction`. The method must write in one transaction,
+    or a retry would run again what was already committed.
+    """
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        return retry_outside_transaction(lambda: method(view, request, *args, **kwargs))
+    return wrapper
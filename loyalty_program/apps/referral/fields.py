@@ -0,0 +1,81 @@
+"""
+Compact storage for CPF numbers. The database keeps them as 64-bit integers,
+so primary key, unique and foreign key indexes compare integers and are
+about half the size of the varchar(14) ones, while the application (and
+the API) keeps seeing the 11-digit string, like with BRCPFField.
+"""
+from django import forms
+from django.db import models
+from django.utils.functional import cached_property
+from localflavor.br.validators import BRCPFValidator
+
+# What a lookup by a value that isn't a CPF compares to.
+NO_CPF = -1
+
+
+def normalize_cpf(value):
+    """
+    Removes the punctuation of a formatted CPF ('000.111.222-33'), keeping
+    any other character, so invalid values still fail validation.
+    """
+    return str(value).replace('.', '').replace('-', '')
+
+
+def cpf_number(value):
+    """
+    The integer of a CPF given as an integer or an 11-digit string
+    (formatted or not), or None if it isn't one.
+    """
+    if isinstance(value, int):
+        return value if 0 <= value < 10 ** 11 else None
+    digits = normalize_cpf(value)
+    if len(digits) != 11 or not (digits.isascii() and digits.isdigit()):
+        return None
+    return int(digits)
+
+
+class CompactCPFField(models.BigIntegerField):
+    """
+    A CPF stored as a BIGINT. It accepts the 11-digit string (formatted or
+    not) or an integer, and always returns the 11-digit string, with the
+    leading zeros, when read from the database.
+
+    A lookup by something that isn't a CPF matches nothing (no CPF is
+    negative), while saving it is an error.
+    """
+
+    description = 'CPF Document stored as an integer'
+    default_validators = [BRCPFValidator()]
+
+    @cached_property
+    def validators(self):
+        # the integer range validators don't apply to the string value
+        return [*self.default_validators, *self._validators]
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return f'{value:011d}'
+
+    def to_python(self, value):
+        if value is None:
+            return value
+        if isinstance(value, int):
+            return f'{value:011d}'
+        return normalize_cpf(value)
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return value
+        number = cpf_number(value)
+        return NO_CPF if number is None else number
+
+    def get_db_prep_save(self, value, connection):
+        if value is not None and cpf_number(value) is None:
+            raise ValueError(f"Field '{self.name}' expected a CPF but got {value!r}.")
+        return super().get_db_prep_save(value, connection)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{
+            'form_class': forms.CharField, 'max_length': 14, **kwargs})
@@ -0,0 +1,74 @@
+"""
+Query parameter filters for the referral listing (/all-referrals/). Every
+filter maps to an indexed column, so they are index range scans.
+"""
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time
+import pytz
+from localflavor.br.validators import BRCPFValidator
+from rest_framework.exceptions import ValidationError
+
+from .fields import normalize_cpf
+
+BOOLEAN_VALUES = {'true': True, '1': True, 'false': False, '0': False}
+
+
+def parse_boolean(name, value):
+    try:
+        return BOOLEAN_VALUES[value.lower()]
+    except KeyError:
+        raise ValidationError({name: ['Must be true or false.']})
+
+
+def parse_moment(name, value):
+    """
+    Parses a datetime ('2021-12-21T15:22:23-03:00') or a date ('2021-12-21',
+    meaning its midnight) on the current timezone, if it has none.
+    """
+    # well formatted but impossible dates (2021-02-30) raise ValueError, and
+    # local times skipped or repeated by a DST change raise the pytz errors
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(value)
+            moment = datetime.combine(day, time.min)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+    except (ValueError, pytz.InvalidTimeError):
+        raise ValidationError(
+            {name: ['Must be a date (YYYY-MM-DD) or an ISO 8601 datetime.']})
+    return moment
+
+
+def filter_referrals(queryset, query_params):
+    """
+    Filters the referrals by the query parameters:
+    - status: true or false;
+    - created_after / created_before: creation date range (inclusive);
+    - updated_since: last update at or after this moment;
+    - source_cpf: CPF of the referrer.
+    """
+    if 'status' in query_params:
+        queryset = queryset.filter(
+            status=parse_boolean('status', query_params['status']))
+    if 'created_after' in query_params:
+        queryset = queryset.filter(created_at__gte=parse_moment(
+            'created_after', query_params['created_after']))
+    if 'created_before' in query_params:
+        queryset = queryset.filter(created_at__lte=parse_moment(
+            'created_before', query_params['created_before']))
+    if 'updated_since' in query_params:
+        queryset = queryset.filter(updated_at__gte=parse_moment(
+            'updated_since', query_params['updated_since']))
+    if 'source_cpf' in query_params:
+        source_cpf = normalize_cpf(query_params['source_cpf'])
+        try:
+            BRCPFValidator()(source_cpf)
+        except DjangoValidationError:
+            raise ValidationError({'source_cpf': ['Must be a valid CPF.']})
+        queryset = queryset.filter(source_cpf=source_cpf)
+    return queryset
@@ -0,0 +1,145 @@
+"""
+Idempotency-Key support for the POST endpoints. The first response to a
+key (its status and rendered body) is kept on the IdempotencyRecord table
+for settings.IDEMPOTENCY_KEY_TTL seconds, and a retry with the same key
+gets it back with one primary key lookup, without running the view again,
+so it doesn't validate anything or touch the clients and referrals.
+
+A key reused with a different body gets a 422, and a retry that arrives
+while the first request is still running gets a 409. The table is shared
+by every process, so retries landing on another process are answered too,
+and stored responses are never evicted before their TTL, unlike on a cache.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from datetime import timedelta
+from functools import wraps
+from hashlib import md5
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Seconds a key stays reserved by a request that is still running, so a
+# process that dies mid-request doesn't lock the key until its TTL.
+IN_PROGRESS_TIMEOUT = 60
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStore:
+    """
+    Responses by endpoint and Idempotency-Key, with a fingerprint of the
+    request body, so a key can't replay the response of another request.
+    """
+
+    @staticmethod
+    def key(scope, idempotency_key):
+        digest = md5(idempotency_key.encode()).hexdigest()
+        return f'{scope}:{digest}'
+
+    @staticmethod
+    def fingerprint(request):
+        return md5(request.body).hexdigest()
+
+    @staticmethod
+    def entry(key):
+        """
+        The fingerprint, status and content stored for the key, if it
+        hasn't expired.
+        """
+        return IdempotencyRecord.objects.filter(
+            key=key, expires_at__gt=timezone.now()).values(
+            'fingerprint', 'status', 'content').first()
+
+    @staticmethod
+    def reserve(key, fingerprint):
+        """
+        Reserves the key for a running request. Returns True if it was free
+        (never used, or expired), False if another request has it.
+        """
+        now = timezone.now()
+        fields = {'fingerprint': fingerprint, 'status': None, 'content': b'',
+                  'expires_at': now + timedelta(seconds=IN_PROGRESS_TIMEOUT)}
+        # the expired keys of every endpoint are dropped as new ones arrive
+        IdempotencyRecord.objects.filter(expires_at__lte=now).delete()
+        try:
+            with transaction.atomic():
+                IdempotencyRecord.objects.create(key=key, **fields)
+            return True
+        except IntegrityError:
+            # unless it expired in the meantime
+            return IdempotencyRecord.objects.filter(
+                key=key, expires_at__lte=now).update(**fields) == 1
+
+    def run(self, scope, idempotency_key, request, handler):
+        """
+        Returns the stored response of the key or, the first time, the one
+        of `handler`, which is stored unless it's a server error.
+        """
+        key = self.key(scope, idempotency_key)
+        fingerprint = self.fingerprint(request)
+
+        entry = self.entry(key)
+        if entry is None and self.reserve(key, fingerprint):
+            try:
+                response = handler()
+            except Exception:
+                IdempotencyRecord.objects.filter(key=key).delete()
+                raise
+            if response.status_code >= 500:
+                IdempotencyRecord.objects.filter(key=key).delete()
+                return response
+            IdempotencyRecord.objects.filter(key=key).update(
+                status=response.status_code,
+                content=JSONRenderer().render(response.data),
+                expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL))
+            return response
+
+        # another request reserved the key first
+        entry = entry or self.entry(key) or {'fingerprint': fingerprint, 'status': None}
+        if entry['fingerprint'] != fingerprint:
+            logger.warning("Idempotency-Key reused with another request, returning 422.")
+            return Response({"error": "This Idempotency-Key was used with another request."},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if entry['status'] is None:
+            logger.warning("Request with this Idempotency-Key is still running, returning 409.")
+            return Response({"error": "A request with this Idempotency-Key is in progress."},
+                            status=status.HTTP_409_CONFLICT)
+
+        logger.info("Replaying the stored response of the Idempotency-Key.")
+        response = HttpResponse(bytes(entry['content']), status=entry['status'],
+                                content_type='application/json')
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+
+idempotency_store = IdempotencyStore()
+
+
+def idempotent(scope):
+    """
+    Decorator of a view method that makes it idempotent for the requests
+    with an Idempotency-Key header. Requests without it run as usual.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            idempotency_key = request.headers.get('Idempotency-Key')
+            if idempotency_key is None:
+                return method(view, request, *args, **kwargs)
+            if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"error": f"Idempotency-Key must have 1 to {MAX_KEY_LENGTH} characters."},
+                    status=status.HTTP_400_BAD_REQUEST)
+            return idempotency_store.run(
+                scope, idempotency_key, request,
+                lambda: method(view, request, *args, **kwargs))
+        return wrapper
+    return decorator
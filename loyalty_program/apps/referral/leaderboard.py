@@ -0,0 +1,85 @@
+"""
+Points leaderboard. The top clients are kept in memory, per process, so the
+leaderboard endpoint can be polled without hitting the database: credits
+to clients already on it are applied in place, and it is reloaded, with one
+query on the (points, cpf) index, when a client outside of it is credited
+or after settings.LEADERBOARD_TTL seconds, to see the points credited by
+other processes.
+"""
+from django.conf import settings
+from django.db.models import Q
+import threading
+import time
+
+from .models import Client
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def client_rank(cpf):
+    """
+    Position of the client on the leaderboard, ordered by points and then
+    by CPF, counted with a range query on the points index. Returns None if
+    the client doesn't exist.
+    """
+    points = Client.objects.filter(cpf=cpf).values_list('points', flat=True).first()
+    if points is None:
+        return None
+    ahead = Client.objects.filter(Q(points__gt=points) | Q(points=points, cpf__lt=cpf))
+    return {'rank': ahead.count() + 1, 'points': points}
+
+
+class Leaderboard:
+    """
+    In-process cache of the top clients with points, as a list of dicts
+    with their rank, CPF, name and points.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._top = None
+        self._loaded_at = 0
+
+    def top(self, limit):
+        """
+        The first `limit` clients (at most settings.LEADERBOARD_SIZE).
+        """
+        with self._lock:
+            if self._top is None or time.monotonic() - self._loaded_at > settings.LEADERBOARD_TTL:
+                self._load()
+            return [{'rank': rank, **entry}
+                    for rank, entry in enumerate(self._top[:limit], start=1)]
+
+    def record_credits(self, credits):
+        """
+        Applies the points credited to each CPF of `credits`. Credits only
+        raise clients, so the top doesn't change unless a client outside of
+        it was credited, which makes it reload on the next read.
+        """
+        with self._lock:
+            if self._top is None:
+                return
+            entries = {entry['cpf']: entry for entry in self._top}
+            for cpf, points in credits.items():
+                if cpf not in entries:
+                    self._top = None
+                    return
+                entries[cpf]['points'] += points
+            self._top.sort(key=lambda entry: (-entry['points'], entry['cpf']))
+
+    def invalidate(self):
+        with self._lock:
+            self._top = None
+
+    def _load(self):
+        logger.info("Loading the leaderboard from the database.")
+        self._top = [
+            {'cpf': cpf, 'name': name, 'points': points}
+            for cpf, name, points in Client.objects.filter(points__gt=0)
+            .order_by('-points', 'cpf').values_list('cpf', 'name', 'points')[:settings.LEADERBOARD_SIZE]
+        ]
+        self._loaded_at = time.monotonic()
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+STORAGES = {
+    'varchar(14)': ('varchar(14)', lambda cpf: f'{cpf:011d}'),
+    'bigint': ('bigint', lambda cpf: cpf),
+}
+
+
+class Command(BaseCommand):
+    """
+    Compares the CPF primary key stored as varchar(14) (BRCPFField) and as
+    bigint (CompactCPFField): index size and point lookup latency. It runs
+    on a temporary SQLite file, not on the project database.
+    Usage: python manage.py benchmark_cpf_storage [--rows 10000000] [--lookups N]
+    """
+
+    help = 'Benchmarks the varchar and the integer CPF storage.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of CPFs on each table.')
+        parser.add_argument('--lookups', type=int, default=20000,
+                            help='Number of point lookups timed on each table.')
+
+    def handle(self, *args, **options):
+        rows, lookups = options['rows'], options['lookups']
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+
+        try:
+            connection = sqlite3.connect(path)
+            connection.execute('PRAGMA journal_mode=OFF')
+            connection.execute('PRAGMA synchronous=OFF')
+
+            for name, (column_type, to_db) in STORAGES.items():
+                table = 'cpf_' + column_type.split('(')[0]
+                connection.execute(
+                    f'CREATE TABLE {table} (cpf {column_type} NOT NULL PRIMARY KEY, points integer)')
+                connection.executemany(
+                    f'INSERT INTO {table} VALUES (?, 0)',
+                    ((to_db(cpf),) for cpf in self.cpfs(rows)))
+                connection.commit()
+
+                size = self.index_size(connection, table)
+                latency = self.lookup_latency(connection, table, to_db, rows, lookups)
+                self.stdout.write(
+                    f'{name:>12}: index {size / 2 ** 20:8.1f} MiB | '
+                    f'lookup {latency * 1e6:6.2f} us (median of {lookups})')
+            connection.close()
+        finally:
+            os.remove(path)
+
+    @staticmethod
+    def cpfs(rows):
+        """
+        Distinct, scattered 11-digit numbers (7919 is coprime with 10**11).
+        """
+        for i in range(rows):
+            yield (i * 7919 + 12345) % 10 ** 11
+
+    @staticmethod
+    def index_size(connection, table):
+        """
+        Size in bytes of the primary key index of the table.
+        """
+        return connection.execute(
+            "SELECT SUM(pgsize) FROM dbstat WHERE name LIKE ?",
+            (f'sqlite_autoindex_{table}_%',)).fetchone()[0]
+
+    @staticmethod
+    def lookup_latency(connection, table, to_db, rows, lookups):
+        query = f'SELECT points FROM {table} WHERE cpf = ?'
+        timings = []
+        for _ in range(lookups):
+            i = random.randrange(rows)
+            cpf = to_db((i * 7919 + 12345) % 10 ** 11)
+            started = time.perf_counter()
+            connection.execute(query, (cpf,)).fetchone()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return timings[len(timings) // 2]
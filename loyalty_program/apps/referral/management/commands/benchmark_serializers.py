@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+import time
+
+from ...models import Client, Referral
+from ...serializers import FastReadSerializer, ReferralSerializer
+
+
+class Command(BaseCommand):
+    """
+    Compares the rows/sec of ReferralSerializer and FastReadSerializer on the
+    same referrals. The rows are created inside a transaction that is rolled
+    back at the end, so the database is left untouched.
+    Usage: python manage.py benchmark_serializers [--rows N] [--repeat N]
+    """
+
+    help = 'Benchmarks the model serializer against the fast read serializer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Number of referrals to serialize.')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of runs; the best one is reported.')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+
+        with transaction.atomic():
+            now = timezone.now()
+            client, _ = Client.objects.get_or_create(
+                cpf='11987098390', defaults={'name': 'Luisa Souza',
+                                             'phone': '31998877554',
+                                             'email': 'luisa@gmail.com'})
+            Referral.objects.bulk_create([
+                Referral(source_cpf=client, target_cpf=f'{i:011d}',
+                         created_at=now, updated_at=now)
+                for i in range(rows)
+            ], batch_size=1000)
+            queryset = Referral.objects.order_by('id')
+
+            def model_serializer():
+                return ReferralSerializer(queryset.all(), many=True).data
+
+            def fast_serializer():
+                serializer = FastReadSerializer(ReferralSerializer)
+                return serializer.serialize(serializer.rows(queryset.all()))
+
+            results = {}
+            for name, run in [('ReferralSerializer', model_serializer),
+                              ('FastReadSerializer', fast_serializer)]:
+                best = min(self.timed(run) for _ in range(options['repeat']))
+                results[name] = rows / best
+                self.stdout.write(f'{name}: {results[name]:,.0f} rows/sec')
+
+            transaction.set_rollback(True)
+
+        speedup = results['FastReadSerializer'] / results['ReferralSerializer']
+        self.stdout.write(self.style.SUCCESS(f'Speedup: {speedup:.1f}x'))
+
+    @staticmethod
+    def timed(run):
+        started = time.perf_counter()
+        run()
+        return time.perf_counter() - started
@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from ...database import apply_pragmas, is_lock_error, retry_on_lock
+
+# What SQLite does without pragmas: a rollback journal, deleted on every
+# commit, synced in full.
+DEFAULT_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+class Command(BaseCommand):
+    """
+    Compares the read and write throughput of concurrent threads on SQLite
+    with its default settings and with settings.SQLITE_PRAGMAS. The readers
+    look up clients by CPF, and the writers credit a referral like the
+    accept endpoint (read the client, then update it and append to the
+    ledger, in one transaction), retrying with backoff when the database is
+    locked. It runs on a temporary SQLite file, not on the project database.
+    Usage: python manage.py benchmark_sqlite [--threads 8] [--seconds 3] [--writers 0.2]
+    """
+
+    help = 'Benchmarks concurrent reads and writes on SQLite, before and after the pragmas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Number of concurrent threads.')
+        parser.add_argument('--seconds', type=float, default=3,
+                            help='Duration of each run.')
+        parser.add_argument('--writers', type=float, default=0.2,
+                            help='Share of the operations that are writes.')
+        parser.add_argument('--rows', type=int, default=10000,
+                            help='Number of clients on the table.')
+
+    def handle(self, *args, **options):
+        for name, pragmas in [('default', DEFAULT_PRAGMAS),
+                              ('SQLITE_PRAGMAS', settings.SQLITE_PRAGMAS)]:
+            handle, path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(handle)
+            try:
+                self.create_database(path, options['rows'])
+                result = self.run(path, pragmas, options)
+            finally:
+                for suffix in ('', '-wal', '-shm', '-journal'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{name:>14}: {result["reads"] / seconds:9,.0f} reads/s | '
+                f'{result["writes"] / seconds:7,.0f} writes/s | '
+                f'{result["retries"]} lock retries | {result["failures"]} failed writes')
+
+    @staticmethod
+    def create_database(path, rows):
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE client (cpf bigint NOT NULL PRIMARY KEY, points integer)')
+        connection.execute(
+            'CREATE TABLE point_transaction (id integer PRIMARY KEY, client_cpf bigint, amount integer)')
+        connection.executemany('INSERT INTO client VALUES (?, 0)', ((cpf,) for cpf in range(rows)))
+        connection.commit()
+        connection.close()
+
+    def run(self, path, pragmas, options):
+        totals = {'reads': 0, 'writes': 0, 'retries': 0, 'failures': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def worker():
+            counts = dict.fromkeys(totals, 0)
+            # autocommit, with explicit transactions, like django
+            connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+            apply_pragmas(connection, pragmas)
+            while time.monotonic() < deadline:
+                cpf = random.randrange(options['rows'])
+                if random.random() >= options['writers']:
+                    connection.execute('SELECT points FROM client WHERE cpf = ?', (cpf,)).fetchone()
+                    counts['reads'] += 1
+                    continue
+
+                def credit():
+                    counts['retries'] += 1
+                    self.credit(connection, cpf)
+                try:
+                    retry_on_lock(credit)
+                    counts['writes'] += 1
+                except sqlite3.OperationalError as error:
+                    if not is_lock_error(error):
+                        raise
+                    counts['failures'] += 1
+                # the first run of each write isn't a retry
+                counts['retries'] -= 1
+            connection.close()
+            with lock:
+                for key, value in counts.items():
+                    totals[key] += value
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return totals
+
+    @staticmethod
+    def credit(connection, cpf):
+        connection.execute('BEGIN')
+        try:
+            points = connection.execute(
+                'SELECT points FROM client WHERE cpf = ?', (cpf,)).fetchone()[0]
+            connection.execute('UPDATE client SET points = ? WHERE cpf = ?', (points + 10, cpf))
+            connection.execute(
+                'INSERT INTO point_transaction (client_cpf, amount) VALUES (?, 10)', (cpf,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...utils import PURGE_BATCH_SIZE, sweep_expired_referrals
+
+
+class Command(BaseCommand):
+    """
+    Moves the referrals that expired without being accepted to the archive.
+    Usage: python manage.py expire_referrals [--batch-size N] [--no-archive]
+    """
+
+    help = 'Archives pending referrals older than 30 days.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE,
+                            help='Number of referrals moved per chunk.')
+        parser.add_argument('--no-archive', action='store_true',
+                            help='Delete the expired referrals instead of archiving them.')
+
+    def handle(self, *args, **options):
+        if not 0 < options['batch_size'] <= PURGE_BATCH_SIZE:
+            raise CommandError(f'--batch-size must be between 1 and {PURGE_BATCH_SIZE}.')
+        archive = not options['no_archive']
+        result = sweep_expired_referrals(batch_size=options['batch_size'],
+                                         archive=archive)
+
+        if result is None:
+            self.stdout.write('Another worker is already sweeping, nothing done.')
+            return
+
+        count, elapsed = result
+        action = 'Archived' if archive else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {count} expired referrals in {elapsed:.3f}s.'))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+import csv
+import json
+import os
+
+from ...utils import PURGE_BATCH_SIZE, import_clients
+
+
+class Command(BaseCommand):
+    """
+    Creates clients in bulk from a CSV file (with the header
+    cpf,name,phone,email) or a JSON Lines file (one object per line),
+    listing the rows that were rejected.
+    Usage: python manage.py import_clients <path> [--format csv|jsonl] [--batch-size N]
+    """
+
+    help = 'Imports clients from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with the clients.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Format of the file (by default, its extension).')
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE,
+                            help='Number of rows validated and inserted per chunk.')
+
+    def handle(self, *args, **options):
+        if not 0 < options['batch_size'] <= PURGE_BATCH_SIZE:
+            raise CommandError(f'--batch-size must be between 1 and {PURGE_BATCH_SIZE}.')
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in ('csv', 'jsonl'):
+            raise CommandError('Unknown file format, use --format csv or --format jsonl.')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                if file_format == 'csv':
+                    # the first line is the header
+                    rows, first_line = csv.DictReader(file), 2
+                else:
+                    rows, first_line = self.json_lines(file), 1
+                created, errors, elapsed = import_clients(
+                    rows, batch_size=options['batch_size'])
+        except OSError as error:
+            raise CommandError(f'Could not read {path}: {error}')
+
+        for index, row_errors in sorted(errors.items()):
+            self.stdout.write(f'line {index + first_line}: {json.dumps(row_errors)}')
+
+        total = created + len(errors)
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {created} of {total} clients in {elapsed:.3f}s ({rate:,.0f} rows/sec).'))
+
+    @staticmethod
+    def json_lines(file):
+        """
+        The object of each line; a line that isn't valid JSON is passed on
+        as it is, so it's rejected by the validation.
+        """
+        for line in file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield line
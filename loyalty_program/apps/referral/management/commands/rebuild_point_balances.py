@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from ...utils import rebuild_point_balances
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the points of every client from the points ledger, listing the
+    balances that didn't match it.
+    Usage: python manage.py rebuild_point_balances [--dry-run]
+    """
+
+    help = 'Reconciles the client balances with the points ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the mismatched balances, without fixing them.')
+
+    def handle(self, *args, **options):
+        mismatches = rebuild_point_balances(dry_run=options['dry_run'])
+
+        for cpf, stored, balance in mismatches:
+            self.stdout.write(f'{cpf}: balance {stored}, ledger {balance}')
+
+        action = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {len(mismatches)} mismatched balances.'))
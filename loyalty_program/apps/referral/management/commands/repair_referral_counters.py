@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ...utils import recompute_referral_counters
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the referral counters of every client from the referrals
+    table, fixing any drift from writes made outside the API.
+    Usage: python manage.py repair_referral_counters
+    """
+
+    help = 'Recomputes the denormalized referral counters of the clients.'
+
+    def handle(self, *args, **options):
+        count = recompute_referral_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed the referral counters of {count} clients.'))
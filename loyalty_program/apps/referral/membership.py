@@ -0,0 +1,212 @@
+"""
+In-memory membership filters of the registered client CPFs and of the
+referred (target) CPFs, so the views can skip a lookup when a CPF is
+definitely new.
+
+They are counting Bloom filters: a CPF that was added is always reported
+as "maybe present", and a CPF that wasn't is reported as present with
+probability
+
+    p = (1 - e ** (-k * n / m)) ** k
+
+for n CPFs on m counters with k hashes. m and k are sized from
+settings.MEMBERSHIP_FILTER_CAPACITY and MEMBERSHIP_FILTER_ERROR_RATE, so p
+stays at that rate (1% by default) up to the capacity; past it the filter
+is rebuilt with twice the capacity. A "maybe" always falls back to the
+database.
+
+The filters are built from the database on a background thread, started
+with the other background jobs of the processes that serve requests, and
+they answer "maybe" until then, so no request waits for a build. They are
+kept up to date with the inserts and deletes this process makes. A CPF
+added by another process may be missing, so they are only used where a
+database constraint catches what the filter misses: the primary key of
+Client and the unique target_cpf of Referral.
+"""
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from hashlib import blake2b
+import math
+import threading
+
+from .fields import normalize_cpf
+from .models import Client, Referral
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class CountingBloomFilter:
+    """
+    Bloom filter with one 8-bit counter per position, so items can also be
+    removed. Counters saturate at 255 and are never decremented after that.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.counters = bytearray(self.size)
+        self.count = 0
+
+    def positions(self, item):
+        # double hashing: k positions from the two halves of one digest
+        digest = blake2b(str(item).encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big')
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            if self.counters[position] < 255:
+                self.counters[position] += 1
+        self.count += 1
+
+    def remove(self, item):
+        positions = self.positions(item)
+        if not all(self.counters[position] for position in positions):
+            return
+        for position in positions:
+            if self.counters[position] < 255:
+                self.counters[position] -= 1
+        self.count -= 1
+
+    def __contains__(self, item):
+        return all(self.counters[position] for position in self.positions(item))
+
+    def false_positive_rate(self):
+        """
+        Expected false positive rate for the current number of items.
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+
+class MembershipFilter:
+    """
+    Thread-safe filter of the CPFs of one column, built from the database
+    in the background.
+    """
+
+    def __init__(self, name, queryset):
+        self.name = name
+        self.queryset = queryset
+        self._lock = threading.Lock()
+        self._filter = None
+        # CPFs added while a build runs, applied to the filter it builds
+        self._pending = None
+
+    def build(self, capacity=None):
+        """
+        Builds the filter from the database and swaps it in. The table is
+        read without holding the lock, so the current filter keeps
+        answering meanwhile.
+        """
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        try:
+            count = self.queryset.count()
+            capacity = max(capacity or settings.MEMBERSHIP_FILTER_CAPACITY, 2 * count)
+            bloom = CountingBloomFilter(capacity, settings.MEMBERSHIP_FILTER_ERROR_RATE)
+            for value in self.queryset.all().iterator(chunk_size=10000):
+                bloom.add(value)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for key in self._pending:
+                bloom.add(key)
+            self._pending = None
+            self._filter = bloom
+        logger.info("Built the %s membership filter with %s values.", self.name, bloom.count)
+
+    def start_build(self, capacity=None):
+        """
+        Builds the filter on a background thread, unless a build is already
+        running.
+        """
+        with self._lock:
+            if self._pending is not None:
+                return
+            self._pending = []
+        threading.Thread(target=self._build_in_background, args=(capacity,),
+                         name=f'{self.name} filter build', daemon=True).start()
+
+    def _build_in_background(self, capacity):
+        try:
+            self.build(capacity)
+        except Exception:
+            logger.exception("Building the %s membership filter failed.", self.name)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def key(cpf):
+        """
+        The 11-digit string of a CPF given formatted, unformatted or as an
+        integer, like the database returns it.
+        """
+        digits = normalize_cpf(cpf)
+        return f'{int(digits):011d}' if digits.isdigit() else digits
+
+    def might_contain(self, cpf):
+        """
+        False when the CPF is definitely not on the table, True when it
+        may be (and the database has to be checked), or while the filter
+        isn't built yet.
+        """
+        with self._lock:
+            if self._filter is None:
+                return True
+            return self.key(cpf) in self._filter
+
+    def add(self, cpfs):
+        with self._lock:
+            keys = [self.key(cpf) for cpf in cpfs]
+            if self._pending is not None:
+                self._pending.extend(keys)
+            if self._filter is None:
+                return
+            for key in keys:
+                self._filter.add(key)
+            over_capacity = self._filter.count > self._filter.capacity
+            capacity = 2 * self._filter.capacity
+        if over_capacity:
+            self.start_build(capacity)
+
+    def remove(self, cpfs):
+        # a CPF removed while a build runs may stay on the new filter, which
+        # is only a false positive
+        with self._lock:
+            if self._filter is None:
+                return
+            for cpf in cpfs:
+                self._filter.remove(self.key(cpf))
+
+    def reset(self):
+        with self._lock:
+            self._filter = None
+
+
+client_cpfs = MembershipFilter('client CPF', Client.objects.values_list('cpf', flat=True))
+referred_cpfs = MembershipFilter('referred CPF', Referral.objects.values_list('target_cpf', flat=True))
+
+
+@receiver(post_save, sender=Client)
+def add_saved_client(sender, instance, created, **kwargs):
+    if created:
+        client_cpfs.add([instance.cpf])
+
+
+@receiver(post_delete, sender=Client)
+def remove_deleted_client(sender, instance, **kwargs):
+    transaction.on_commit(lambda: client_cpfs.remove([instance.cpf]))
+
+
+@receiver(post_save, sender=Referral)
+def add_saved_referral(sender, instance, created, **kwargs):
+    if created:
+        referred_cpfs.add([instance.target_cpf])
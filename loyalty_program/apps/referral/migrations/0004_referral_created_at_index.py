@@ -0,0 +1,18 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0003_alter_referral_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='referral',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0004_referral_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SweepLock',
+            fields=[
+                ('name', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('owner', models.CharField(blank=True, max_length=255)),
+                ('locked_until', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0005_sweeplock'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='referral',
+            index=models.Index(fields=['status', 'created_at'], name='referral_status_created_idx'),
+        ),
+    ]
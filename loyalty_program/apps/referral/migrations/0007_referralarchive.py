@@ -0,0 +1,27 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:35
+
+from django.db import migrations, models
+import localflavor.br.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0006_referral_status_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField()),
+                ('source_cpf', localflavor.br.models.BRCPFField(max_length=14, verbose_name='CPF do usuário indicador')),
+                ('target_cpf', localflavor.br.models.BRCPFField(max_length=14, verbose_name='CPF da pessoa indicada')),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('status', models.BooleanField(default=False)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
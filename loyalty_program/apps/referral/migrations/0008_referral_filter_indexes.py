@@ -0,0 +1,22 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0007_referralarchive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='referral',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='referral',
+            index=models.Index(fields=['source_cpf', 'created_at'], name='referral_source_created_idx'),
+        ),
+    ]
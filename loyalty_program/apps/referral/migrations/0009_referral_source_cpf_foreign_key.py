@@ -0,0 +1,44 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def archive_referrals_without_referrer(apps, schema_editor):
+    """
+    Referrals whose referrer is not a client would break the new foreign
+    key, so they are moved to the archive before the field is altered.
+    """
+    Client = apps.get_model('referral', 'Client')
+    Referral = apps.get_model('referral', 'Referral')
+    ReferralArchive = apps.get_model('referral', 'ReferralArchive')
+
+    orphans = Referral.objects.exclude(
+        source_cpf__in=Client.objects.values('cpf'))
+    ReferralArchive.objects.bulk_create([
+        ReferralArchive(original_id=referral.id,
+                        source_cpf=referral.source_cpf,
+                        target_cpf=referral.target_cpf,
+                        created_at=referral.created_at,
+                        updated_at=referral.updated_at,
+                        status=referral.status)
+        for referral in orphans
+    ])
+    orphans.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0008_referral_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(archive_referrals_without_referrer,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='referral',
+            name='source_cpf',
+            field=models.ForeignKey(db_column='source_cpf', db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='referrals', to='referral.client', verbose_name='CPF do usuário indicador'),
+        ),
+    ]
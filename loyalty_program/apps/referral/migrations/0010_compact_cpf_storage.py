@@ -0,0 +1,34 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:43
+
+from django.db import migrations
+import loyalty_program.apps.referral.fields
+
+
+NORMALIZE_CPFS = [
+    "UPDATE referral_client SET cpf = REPLACE(REPLACE(cpf, '.', ''), '-', '')",
+    "UPDATE referral_referral SET source_cpf = REPLACE(REPLACE(source_cpf, '.', ''), '-', ''), "
+    "target_cpf = REPLACE(REPLACE(target_cpf, '.', ''), '-', '')",
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0009_referral_source_cpf_foreign_key'),
+    ]
+
+    operations = [
+        # formatted CPFs ('000.111.222-33') are stored only with the digits,
+        # so they can be converted to integers
+        migrations.RunSQL(NORMALIZE_CPFS, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='client',
+            name='cpf',
+            field=loyalty_program.apps.referral.fields.CompactCPFField(help_text='Formato: 00011122233', primary_key=True, serialize=False, verbose_name='CPF '),
+        ),
+        migrations.AlterField(
+            model_name='referral',
+            name='target_cpf',
+            field=loyalty_program.apps.referral.fields.CompactCPFField(unique=True, verbose_name='CPF da pessoa indicada'),
+        ),
+    ]
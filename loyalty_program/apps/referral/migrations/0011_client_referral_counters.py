@@ -0,0 +1,49 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:46
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def count_existing_referrals(apps, schema_editor):
+    """
+    Fills the new counters from the referrals already stored, with one
+    GROUP BY query.
+    """
+    Client = apps.get_model('referral', 'Client')
+    Referral = apps.get_model('referral', 'Referral')
+
+    counts = (Referral.objects.order_by().values('source_cpf')
+              .annotate(total=Count('id'),
+                        accepted=Count('id', filter=Q(status=True))))
+    for row in counts:
+        Client.objects.filter(cpf=row['source_cpf']).update(
+            referrals_total=row['total'],
+            referrals_pending=row['total'] - row['accepted'],
+            referrals_accepted=row['accepted'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0010_compact_cpf_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='referrals_accepted',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='referrals_pending',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='referrals_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_existing_referrals,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_existing_balances(apps, schema_editor):
+    """
+    Points credited before the ledger existed have no history, so each
+    client with points gets an opening balance transaction, keeping the
+    balances equal to the sum of the ledger.
+    """
+    Client = apps.get_model('referral', 'Client')
+    PointTransaction = apps.get_model('referral', 'PointTransaction')
+
+    PointTransaction.objects.bulk_create([
+        PointTransaction(client_id=cpf, amount=points, reason='opening_balance')
+        for cpf, points in Client.objects.filter(points__gt=0).values_list('cpf', 'points')
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0011_client_referral_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Pontos')),
+                ('reason', models.CharField(choices=[('referral_accepted', 'Indicação aceita'), ('opening_balance', 'Saldo inicial')], max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(db_column='client_cpf', db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='point_transactions', to='referral.client', verbose_name='Cliente')),
+                ('referral', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='referral.referral')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pointtransaction',
+            index=models.Index(fields=['client', 'created_at'], name='point_client_created_idx'),
+        ),
+        migrations.RunPython(open_existing_balances,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.11 on 2026-10-16 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0012_point_transaction_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['-points', 'cpf'], name='client_points_idx'),
+        ),
+    ]
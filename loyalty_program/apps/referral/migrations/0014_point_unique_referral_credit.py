@@ -0,0 +1,17 @@
+# Generated by Django 3.2.11 on 2026-10-17 00:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0013_client_points_index'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='pointtransaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('reason', 'referral_accepted')), fields=('referral',), name='point_unique_referral_credit'),
+        ),
+    ]
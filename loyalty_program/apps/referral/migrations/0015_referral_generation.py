@@ -0,0 +1,20 @@
+# Generated by Django 3.2.11 on 2026-10-17 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0014_point_unique_referral_credit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralGeneration',
+            fields=[
+                ('scope', models.CharField(max_length=11, primary_key=True, serialize=False)),
+                ('generation', models.CharField(max_length=32)),
+            ],
+        ),
+    ]
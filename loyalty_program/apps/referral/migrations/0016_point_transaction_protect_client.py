@@ -0,0 +1,19 @@
+# Generated by Django 3.2.11 on 2026-10-17 00:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('referral', '0015_referral_generation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pointtransaction',
+            name='client',
+            field=models.ForeignKey(db_column='client_cpf', db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='point_transactions', to='referral.client', verbose_name='Cliente'),
+        ),
+    ]
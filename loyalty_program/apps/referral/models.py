@@ -1,32 +1,204 @@
 from django.db import models
-from django.db import models
+from django.db.models import Q
+from django.utils import timezone
+from datetime import timedelta
 from localflavor.br.models import BRCPFField
 
+from .fields import CompactCPFField
+
+REFERRAL_EXPIRATION_DAYS = 30
+# points credited to the referrer when a referral is accepted
+REFERRAL_POINTS = 10
+
+
+def expiration_cutoff():
+    """
+    Pending referrals created at or before this moment are expired.
+    """
+    return timezone.now() - timedelta(days=REFERRAL_EXPIRATION_DAYS)
+
 
 class Client(models.Model):
     name = models.CharField(max_length=255, blank=False, verbose_name='Nome')
-    cpf = BRCPFField('CPF ', blank=False, primary_key=True, help_text='Formato: 00011122233')
+    cpf = CompactCPFField('CPF ', blank=False, primary_key=True, help_text='Formato: 00011122233')
     phone = models.CharField(max_length=11, blank=False,
                              help_text='Formato DDD + Número', verbose_name='Telefone')
     email = models.EmailField(max_length=255, blank=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     points = models.PositiveIntegerField(default=0, editable=False)
+    referrals_total = models.PositiveIntegerField(default=0, editable=False)
+    referrals_pending = models.PositiveIntegerField(default=0, editable=False)
+    referrals_accepted = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-points', 'cpf'], name='client_points_idx'),
+        ]
 
     def __str__(self):
         details = f'Cliente: {self.name} | cpf: {self.cpf}'
         return details
 
 
+class ReferralQuerySet(models.QuerySet):
+    """
+    Queryset with the expiration rules of the Referral class.
+    """
+
+    def active(self):
+        return self.filter(Q(status=True) | Q(created_at__gt=expiration_cutoff()))
+
+    def expired(self):
+        return self.filter(status=False, created_at__lte=expiration_cutoff())
+
+
+class ActiveReferralManager(models.Manager):
+    """
+    Manager that only sees accepted referrals and pending referrals that are
+    not expired yet, whether the expired ones were already deleted or not.
+    """
+
+    def get_queryset(self):
+        return ReferralQuerySet(self.model, using=self._db).active()
+
+
 class Referral(models.Model):
-    source_cpf = BRCPFField('CPF do usuário indicador',
-                            blank=False, unique=False)
-    target_cpf = BRCPFField('CPF da pessoa indicada',
-                            blank=False, unique=True)
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    source_cpf = models.ForeignKey(Client, on_delete=models.CASCADE,
+                                   related_name='referrals', db_column='source_cpf',
+                                   db_index=False, verbose_name='CPF do usuário indicador')
+    target_cpf = CompactCPFField('CPF da pessoa indicada',
+                                 blank=False, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     status = models.BooleanField(default=False, blank=True)
 
+    objects = ReferralQuerySet.as_manager()
+    active = ActiveReferralManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'],
+                         name='referral_status_created_idx'),
+            models.Index(fields=['source_cpf', 'created_at'],
+                         name='referral_source_created_idx'),
+        ]
+
+    @property
+    def is_expired(self):
+        return not self.status and self.created_at <= expiration_cutoff()
+
+    def __str__(self):
+        details = f'Indicador: {self.source_cpf_id} | Indicado: {self.target_cpf}'
+        return details
+
+
+class ReferralArchive(models.Model):
+    """
+    Cold storage for referrals that expired without being accepted. They are
+    moved here by the expiration sweep, to keep the Referral table small
+    while keeping the history for analysis.
+    """
+    original_id = models.BigIntegerField()
+    source_cpf = BRCPFField('CPF do usuário indicador', blank=False)
+    target_cpf = BRCPFField('CPF da pessoa indicada', blank=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    status = models.BooleanField(default=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        details = f'Indicador: {self.source_cpf} | Indicado: {self.target_cpf} (arquivada)'
+        return details
+
+
+class PointTransaction(models.Model):
+    """
+    Append-only ledger of the points of the clients. Every credit is written
+    here in the same transaction that updates Client.points, which is the
+    materialized balance: the sum of the amounts of the client.
+    """
+    REFERRAL_ACCEPTED = 'referral_accepted'
+    OPENING_BALANCE = 'opening_balance'
+    REASONS = [
+        (REFERRAL_ACCEPTED, 'Indicação aceita'),
+        (OPENING_BALANCE, 'Saldo inicial'),
+    ]
+
+    # the ledger is never deleted with a client
+    client = models.ForeignKey(Client, on_delete=models.PROTECT,
+                               related_name='point_transactions', db_column='client_cpf',
+                               db_index=False, verbose_name='Cliente')
+    # no constraint, so deleting or archiving referrals stays a plain DELETE
+    # and the ledger keeps the id of the referral that was credited
+    referral = models.ForeignKey(Referral, on_delete=models.DO_NOTHING, null=True,
+                                 blank=True, db_constraint=False, db_index=False,
+                                 related_name='+')
+    amount = models.IntegerField('Pontos')
+    reason = models.CharField(max_length=32, choices=REASONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'created_at'],
+                         name='point_client_created_idx'),
+        ]
+        constraints = [
+            # a referral is credited at most once
+            models.UniqueConstraint(fields=['referral'],
+                                    condition=models.Q(reason='referral_accepted'),
+                                    name='point_unique_referral_credit'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Point transactions are append-only.')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        details = f'Cliente: {self.client_id} | {self.amount:+d} pontos ({self.reason})'
+        return details
+
+
+class SweepLock(models.Model):
+    """
+    Database-backed lock, so only one worker (or node) runs a periodic
+    job such as the expired referrals sweep at a time.
+    """
+    name = models.CharField(max_length=64, primary_key=True)
+    owner = models.CharField(max_length=255, blank=True)
+    locked_until = models.DateTimeField()
+
+    def __str__(self):
+        details = f'Lock: {self.name} | owner: {self.owner}'
+        return details
+
+
+class ReferralGeneration(models.Model):
+    """
+    Generation of the cached referral listings of a scope (the CPF of a
+    referrer, or 'all'), replaced by a random one on the writes that change
+    them. It's kept on the database so every process sees the same one.
+    """
+    scope = models.CharField(max_length=11, primary_key=True)
+    generation = models.CharField(max_length=32)
+
+    def __str__(self):
+        details = f'Generation: {self.scope} | {self.generation}'
+        return details
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Response stored for an Idempotency-Key, until `expires_at`. While the
+    first request runs it has no status yet.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=32)
+    status = models.PositiveSmallIntegerField(null=True)
+    content = models.BinaryField(default=b'')
+    expires_at = models.DateTimeField(db_index=True)
+
     def __str__(self):
-        details = f'Indicador: {self.source_cpf} | Indicado: {self.target_cpf}'
+        details = f'Idempotency-Key: {self.key} | status: {self.status}'
         return details
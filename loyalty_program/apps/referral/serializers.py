@@ -1,20 +1,258 @@
-from rest_framework import serializers
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from rest_framework.validators import UniqueValidator
+from localflavor.br.validators import BRCPFValidator
+from .fields import CompactCPFField, normalize_cpf
 from .models import Client, Referral
 
 
-class ClientSerializer(serializers.ModelSerializer):
+class CPFField(serializers.CharField):
+    """
+    Serializer field for CPFs, read and written as the 11-digit string.
+    The formatted input ('000.111.222-33') is accepted and normalized.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_length', 14)
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        return normalize_cpf(super().to_internal_value(data))
+
+
+CPF_FIELD_MAPPING = {**serializers.ModelSerializer.serializer_field_mapping,
+                     CompactCPFField: CPFField}
+
+
+class BulkAcceptSerializer(serializers.Serializer):
+    """
+    Body of the bulk accept: the CPFs of the referred people. They are only
+    normalized here, each one is validated on its own by the view, so an
+    invalid CPF doesn't fail the others.
+    """
+    target_cpfs = serializers.ListField(child=CPFField(), allow_empty=False)
+
+    def validate_target_cpfs(self, value):
+        if len(value) > settings.REFERRAL_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {settings.REFERRAL_BULK_MAX_ITEMS} elements.')
+        return value
+
+
+class BulkReferralSerializer(serializers.Serializer):
+    """
+    Body of the bulk referral creation: the referrer and the CPFs of the
+    referred people. The targets are only normalized here, each one is
+    validated on its own by the view, so an invalid CPF doesn't fail the
+    others.
+    """
+    source_cpf = CPFField(validators=[BRCPFValidator()])
+    target_cpfs = serializers.ListField(child=CPFField(), allow_empty=False)
+    status = serializers.BooleanField(default=False)
+
+    def validate_target_cpfs(self, value):
+        if len(value) > settings.REFERRAL_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {settings.REFERRAL_BULK_MAX_ITEMS} elements.')
+        return value
+
+
+class BulkClientSerializer(serializers.Serializer):
+    """
+    Body of the bulk client creation. The clients are only checked to be a
+    list here; each one is validated on its own by the import, so an invalid
+    client doesn't fail the others.
+    """
+    clients = serializers.ListField(allow_empty=False)
+
+    def validate_clients(self, value):
+        if len(value) > settings.CLIENT_BULK_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'Ensure this field has no more than {settings.CLIENT_BULK_MAX_ITEMS} elements.')
+        return value
+
+
+class SparseFieldsMixin:
+    """
+    Lets a serializer return only some of its fields, given by the `fields`
+    keyword argument or, if it is not passed, by the '?fields=' query
+    parameter of the request on the serializer context.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is None:
+            fields = requested_fields(self.context.get('request'), type(self))
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ClientSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Serializer for the Client class.
     """
+    serializer_field_mapping = CPF_FIELD_MAPPING
+
     class Meta:
         model = Client
         fields = '__all__'
 
+    def update(self, instance, validated_data):
+        """
+        Saves only the edited columns, so an update never writes back stale
+        points or referral counters maintained by other requests.
+        """
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # the CPF is the primary key, so it's never part of an update
+        instance.save(update_fields=[
+            field for field in [*validated_data, 'updated_at'] if field != 'cpf'])
+        return instance
+
+
+class NewClientSerializer(ClientSerializer):
+    """
+    Serializer for creating a client whose CPF the membership filter knows
+    isn't registered. It skips the unique validator of the CPF (one query
+    per validation); if the filter missed it, the primary key rejects the
+    insert and the view validates again with ClientSerializer.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        cpf = fields['cpf']
+        cpf.validators = [validator for validator in cpf.validators
+                          if not isinstance(validator, UniqueValidator)]
+        return fields
+
 
-class ReferralSerializer(serializers.ModelSerializer):
+class ReferralSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
-    Serializer for the Referral class.
+    Serializer for the Referral class. The referrer is read and written as
+    its CPF, so validating it doesn't need a query; the database foreign key
+    makes sure the referrer exists.
     """
+    serializer_field_mapping = CPF_FIELD_MAPPING
+    source_cpf = CPFField(source='source_cpf_id', validators=[BRCPFValidator()],
+                          label='CPF do usuário indicador')
+
     class Meta:
         model = Referral
         fields = '__all__'
+
+
+class ReferralWriteSerializer(ReferralSerializer):
+    """
+    Serializer for creating and accepting referrals. It skips the unique
+    validator of target_cpf (one query per validation), because the views
+    check the target themselves: CreateReferralView looks up the existing
+    referral, replacing it if expired, and AcceptReferralView does not allow
+    changing the target.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        target_cpf = fields['target_cpf']
+        target_cpf.validators = [validator for validator in target_cpf.validators
+                                 if not isinstance(validator, UniqueValidator)]
+        return fields
+
+
+_declared_fields = {}
+
+
+def declared_fields(serializer_class):
+    """
+    Returns the fields of the serializer class, built only once per class.
+    """
+    if serializer_class not in _declared_fields:
+        _declared_fields[serializer_class] = serializer_class(fields=()).fields
+    return _declared_fields[serializer_class]
+
+
+def requested_fields(request, serializer_class):
+    """
+    Returns the names on the '?fields=' query parameter (like
+    '?fields=target_cpf,status') that are fields of the serializer class,
+    or None if the parameter is missing or has no valid field.
+    """
+    if request is None or not hasattr(request, 'query_params'):
+        return None
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+
+    requested = raw.split(',')
+    fields = [name for name in declared_fields(serializer_class)
+              if name in requested]
+    return fields or None
+
+
+class FastReadSerializer:
+    """
+    Read-only serializer for the GET endpoints, that works on values_list()
+    rows instead of model instances. The field order and the conversion of
+    each field are taken once from the ModelSerializer, so the output is the
+    same JSON, without the per-field overhead of DRF serializers.
+
+    Usage:
+        serializer = FastReadSerializer(ReferralSerializer, fields)
+        rows = serializer.rows(Referral.active.all())
+        data = serializer.serialize(rows)
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        declared = declared_fields(serializer_class)
+        self.names = tuple(name for name in declared
+                           if not fields or name in fields)
+        self.converters = tuple(self.get_converter(declared[name])
+                                for name in self.names)
+
+    def get_converter(self, field):
+        """
+        Returns a cheap function equivalent to field.to_representation.
+        """
+        if isinstance(field, serializers.DateTimeField):
+            output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+            if (settings.USE_TZ and not hasattr(field, 'timezone')
+                    and isinstance(output_format, str)
+                    and output_format.lower() == ISO_8601):
+                return self.datetime_converter(timezone.get_current_timezone())
+        elif isinstance(field, serializers.BooleanField):
+            return bool
+        elif isinstance(field, serializers.IntegerField):
+            return int
+        elif type(field) in (serializers.CharField, serializers.EmailField, CPFField):
+            return str
+        return field.to_representation
+
+    @staticmethod
+    def datetime_converter(tz):
+        def convert(value):
+            value = value.astimezone(tz).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return convert
+
+    def rows(self, queryset, *required):
+        """
+        Returns the queryset as named tuples with the serialized fields first,
+        followed by the `required` ones (used for pagination, for example).
+        """
+        columns = self.names + tuple(name for name in required
+                                     if name not in self.names)
+        return queryset.values_list(*columns, named=True)
+
+    def to_representation(self, row):
+        return {name: None if value is None else convert(value)
+                for name, convert, value in zip(self.names, self.converters, row)}
+
+    def serialize(self, rows):
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
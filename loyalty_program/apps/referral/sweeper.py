@@ -0,0 +1,52 @@
+"""
+In-process periodic sweeper for expired referrals. It is started by the
+WSGI and ASGI entry points (apps.start_background_jobs), on the processes
+that serve requests, when settings.REFERRAL_SWEEP_INTERVAL is set, and
+relies on the
+database lock in utils.sweep_expired_referrals, so running it on several
+workers or nodes is safe.
+"""
+from django.db import connection
+import threading
+
+from .utils import sweep_expired_referrals
+
+import logging
+logger = logging.getLogger(__name__)
+
+_sweeper = None
+
+
+class ExpirySweeper(threading.Thread):
+    """
+    Daemon thread that sweeps expired referrals every `interval` seconds.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='referral-expiry-sweeper', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                sweep_expired_referrals()
+            except Exception:
+                logger.exception("Expired referrals sweep failed.")
+            finally:
+                connection.close()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_sweeper(interval):
+    """
+    Starts the sweeper thread once per process and returns it.
+    """
+    global _sweeper
+    if _sweeper is None:
+        logger.info("Starting expired referrals sweeper every %s seconds.", interval)
+        _sweeper = ExpirySweeper(interval)
+        _sweeper.start()
+    return _sweeper
@@ -0,0 +1,8 @@
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+
+# The test database is a file (see DATABASES on settings.py), and, unlike
+# django's test Client, the RequestsClient doesn't stop the end of each
+# request from closing the database connection, with the test transaction.
+request_started.disconnect(close_old_connections)
+request_finished.disconnect(close_old_connections)
@@ -5,7 +5,7 @@ from unittest.mock import ANY
 from django.test import TestCase
 from rest_framework.test import RequestsClient
 
-from ...models import Referral, Client
+from ...models import PointTransaction, Referral, Client
 from ..utils import create_user, generate_valid_cpf
 
 
@@ -26,7 +26,7 @@ class TestAcceptReferralView(TestCase):
         with freeze_time(self.creation_time):
             create_user()
             Referral.objects.create(
-                source_cpf="11987098390",
+                source_cpf_id="11987098390",
                 target_cpf=self.target_cpf,
                 status=False
             )
@@ -104,6 +104,30 @@ class TestAcceptReferralView(TestCase):
         self.assertEqual(Referral.objects.count(), 1)
         self.assertEqual(json_response, expected_json_response)
         self.assertEqual(client.points, 10)
+        self.assertEqual(client.referrals_accepted, 1)
+        self.assertEqual(PointTransaction.objects.get().amount, 10)
+
+    def test_should_return_400_if_reverting_accepted_referral(self):
+        """
+        Testing if an accepted referral can't be reverted, so accepting,
+        reverting and accepting it again credits the referrer only once.
+        """
+
+        URL = f'http://127.0.0.1:8000/accept-referral/{self.target_cpf}/'
+        body = {'source_cpf': '11987098390', 'target_cpf': self.target_cpf}
+
+        self.assertEqual(self.client.put(URL, {**body, 'status': True}).status_code, 200)
+        response = self.client.put(URL, {**body, 'status': False})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "An accepted referral cannot be reverted"})
+        response = self.client.put(URL, {**body, 'status': True})
+        self.assertEqual(response.status_code, 200)
+
+        client = Client.objects.get(cpf="11987098390")
+        self.assertTrue(Referral.objects.get().status)
+        self.assertEqual((client.points, client.referrals_pending,
+                          client.referrals_accepted), (10, 0, 1))
+        self.assertEqual(PointTransaction.objects.count(), 1)
 
     def test_should_return_400_if_updating_To_invalid_cpf(self):
         """
@@ -159,7 +183,8 @@ class TestAcceptReferralView(TestCase):
 
     def test_should_not_return_expired_referrals(self):
         """
-        Testing if expired referrals are actually deleted from the database.
+        Testing if expired referrals are not returned, even before they
+        are deleted from the database.
         """
 
         target_cpf = generate_valid_cpf()
@@ -168,14 +193,11 @@ class TestAcceptReferralView(TestCase):
 
         with freeze_time(expired_date_formatted):
             Referral.objects.create(
-                source_cpf="11987098390",
+                source_cpf_id="11987098390",
                 target_cpf=target_cpf,
                 status=False
             )
 
-        self.assertEqual(Referral.objects.count(), 2)
-        # before calling a method that deletes expired referrals
-
         URL = f'http://127.0.0.1:8000/accept-referral/{target_cpf}/'
         response = self.client.get(URL)
         json_response = response.json()
@@ -186,5 +208,5 @@ class TestAcceptReferralView(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(json_response, expected_json_response)
 
-        self.assertEqual(Referral.objects.count(), 1)
-        # after calling a method that deletes expired referrals
+        self.assertEqual(Referral.objects.count(), 2)
+        # the expired referral is only deleted by the expire_referrals command
@@ -1,11 +1,13 @@
 from freezegun import freeze_time
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import ANY
+import json
 
 from django.test import TestCase
 from rest_framework.test import RequestsClient
 
-from ...models import Client
+from ...models import Client, Referral
+from ...utils import delete_referrals_older_than_30_days, update_referral_counters
 from ..utils import create_user, generate_valid_cpf, create_referral
 
 
@@ -47,8 +49,9 @@ class TestAllReferralsView(TestCase):
              'updated_at': self.creation_time, 'status': False}]
 
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(json_response), 2)
-        self.assertEqual(json_response, expected_json_response)
+        self.assertEqual(len(json_response['results']), 2)
+        self.assertEqual(json_response['results'], expected_json_response)
+        self.assertIsNone(json_response['next'])
 
     def test_should_retrieve_all_user_referrals_with_200(self):
         """
@@ -68,9 +71,120 @@ class TestAllReferralsView(TestCase):
              'target_cpf': ANY, 'created_at': self.creation_time,
              'updated_at': self.creation_time, 'status': False}]
 
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json_response['results']), 2)
+        self.assertEqual(json_response['results'], expected_json_response)
+        self.assertIsNone(json_response['next'])
+
+    def test_should_paginate_referrals_with_cursor(self):
+        """
+        Testing if the referrals are split in pages of 'page_size' items,
+        following the 'next' cursor until the last page.
+        """
+
+        create_referral()
+        for URL in ['http://127.0.0.1:8000/all-referrals/?page_size=2',
+                    'http://127.0.0.1:8000/all-referrals/11987098390/?page_size=2']:
+            first_page = self.client.get(URL).json()
+            second_page = self.client.get(first_page['next']).json()
+
+            self.assertEqual(
+                [referral['id'] for referral in first_page['results']], [1, 2])
+            self.assertEqual(
+                [referral['id'] for referral in second_page['results']], [3])
+            self.assertIsNone(second_page['next'])
+
+    def test_should_stream_all_referrals(self):
+        """
+        Testing if the GET method with the 'stream' query parameter exports
+        all referrals, as a JSON array or as JSON Lines.
+        """
+
+        expected_referral = {
+            'id': 1, 'source_cpf': '11987098390',
+            'target_cpf': ANY, 'created_at': self.creation_time,
+            'updated_at': self.creation_time, 'status': False}
+
+        response = self.client.get(
+            'http://127.0.0.1:8000/all-referrals/?stream=1&page_size=1')
+        json_response = response.json()
+
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(json_response), 2)
-        self.assertEqual(json_response, expected_json_response)
+        self.assertEqual(json_response[0], expected_referral)
+
+        response = self.client.get(
+            'http://127.0.0.1:8000/all-referrals/?stream=jsonl')
+        lines = response.text.splitlines()
+
+        self.assertEqual(response.headers['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0]), expected_referral)
+
+    def test_should_return_only_requested_fields(self):
+        """
+        Testing if the GET method with the 'fields' query parameter returns
+        only the requested fields, ignoring the unknown ones.
+        """
+
+        URL = 'http://127.0.0.1:8000/all-referrals/?fields=target_cpf,status,unknown'
+        response = self.client.get(URL)
+        json_response = response.json()
+
+        expected_json_response = [
+            {'target_cpf': ANY, 'status': False},
+            {'target_cpf': ANY, 'status': False}]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_response['results'], expected_json_response)
+
+    def test_should_filter_referrals_by_query_parameters(self):
+        """
+        Testing if the GET method filters the referrals by status, creation
+        date range and referrer, and returns 400 for invalid filters.
+        """
+
+        Referral.objects.filter(id=2).update(status=True)
+        old_date = (datetime.now() - timedelta(days=2)).astimezone()
+        with freeze_time(old_date.isoformat()):
+            create_referral()
+        yesterday = (datetime.now() - timedelta(days=1)).date().isoformat()
+
+        def ids(query):
+            response = self.client.get(f'http://127.0.0.1:8000/all-referrals/?{query}')
+            return [referral['id'] for referral in response.json()['results']]
+
+        self.assertEqual(ids('status=false'), [3, 1])
+        self.assertEqual(ids('status=true'), [2])
+        self.assertEqual(ids(f'created_after={yesterday}'), [1, 2])
+        self.assertEqual(ids(f'created_before={yesterday}'), [3])
+        self.assertEqual(ids(f'status=false&created_after={yesterday}'), [1])
+        self.assertEqual(ids('source_cpf=11987098390'), [3, 1, 2])
+        self.assertEqual(ids(f'source_cpf={generate_valid_cpf()}'), [])
+
+        for source_cpf in ('abc', '1' * 24, '11111111111'):
+            response = self.client.get(
+                f'http://127.0.0.1:8000/all-referrals/?source_cpf={source_cpf}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('source_cpf', response.json())
+
+        # not a date, impossible dates and a midnight skipped by DST
+        for moment in ('yesterday', '2021-02-30', '2021-13-01T00:00', '2018-11-04'):
+            response = self.client.get(
+                f'http://127.0.0.1:8000/all-referrals/?created_after={moment}')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('created_after', response.json())
+
+    def test_should_return_404_for_invalid_cursor(self):
+        """
+        Testing if GET method on 'all-referrals/' endpoint returns a 404
+        response if the cursor on the query parameters is not valid.
+        """
+
+        URL = 'http://127.0.0.1:8000/all-referrals/?cursor=invalid'
+        response = self.client.get(URL)
+
+        self.assertEqual(response.status_code, 404)
 
     def test_should_return_404_for_unregistered_user_referrals(self):
         """
@@ -112,3 +226,50 @@ class TestAllReferralsView(TestCase):
 
         self.assertEqual(response.status_code, 404)
         self.assertEqual(json_response, expected_json_response)
+
+    def test_should_serve_referrals_from_cache_until_they_change(self):
+        """
+        Testing if the listings are served from the cache, with only the
+        lookup of their generation, until a referral of the listed referrer is created, accepted or
+        purged, and if the referrals of other users don't invalidate it.
+        """
+
+        ALL_URL = 'http://127.0.0.1:8000/all-referrals/'
+        URL = 'http://127.0.0.1:8000/all-referrals/11987098390/'
+
+        self.assertEqual(self.client.get(ALL_URL).headers['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(URL).headers['X-Cache'], 'MISS')
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(ALL_URL).headers['X-Cache'], 'HIT')
+            response = self.client.get(URL)
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(len(response.json()['results']), 2)
+
+        other = Client.objects.create(cpf="51805510649", name="New cLient",
+                                      phone="31992818778", email="client@gmail.com")
+        Referral.objects.create(source_cpf=other, target_cpf=generate_valid_cpf())
+        update_referral_counters(other.cpf, total=1, pending=1)
+        self.assertEqual(self.client.get(URL).headers['X-Cache'], 'HIT')
+        response = self.client.get(ALL_URL)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['results']), 3)
+
+        create_referral()
+        response = self.client.get(URL)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['results']), 3)
+
+        target_cpf = Referral.objects.filter(source_cpf="11987098390").first().target_cpf
+        self.client.put(f'http://127.0.0.1:8000/accept-referral/{target_cpf}/', {
+            'source_cpf': '11987098390', 'target_cpf': target_cpf, 'status': True})
+        response = self.client.get(URL)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertIn(True, [referral['status'] for referral in response.json()['results']])
+
+        with freeze_time(datetime.now() - timedelta(days=31)):
+            create_referral()
+        self.client.get(URL)
+        self.assertEqual(self.client.get(URL).headers['X-Cache'], 'HIT')
+        delete_referrals_older_than_30_days()
+        self.assertEqual(self.client.get(URL).headers['X-Cache'], 'MISS')
+        self.assertEqual(Referral.objects.filter(source_cpf="11987098390").count(), 3)
@@ -0,0 +1,100 @@
+from freezegun import freeze_time
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from rest_framework.test import RequestsClient
+
+from ...models import Client, PointTransaction, Referral
+from ..utils import create_referral, create_user, generate_valid_cpf
+
+
+class TestBulkAcceptReferralsView(TestCase):
+    """
+    Testing the methods on the 'accept-referrals/' endpoint.
+    """
+
+    URL = 'http://127.0.0.1:8000/accept-referrals/'
+
+    def setUp(self):
+        """
+        Initializing the RequestsClient for all tests, as well as creating
+        two users with pending referrals.
+        """
+
+        self.client = RequestsClient()
+        create_user()
+        self.other = Client.objects.create(
+            cpf=generate_valid_cpf(), name="Ana", phone="31998877554",
+            email="ana@gmail.com", referrals_total=1, referrals_pending=1)
+        self.referrals = [create_referral() for _ in range(3)]
+        self.other_referral = Referral.objects.create(
+            source_cpf=self.other, target_cpf=generate_valid_cpf(), status=False)
+
+    def test_should_accept_referrals_and_credit_each_referrer_once(self):
+        """
+        Testing if the POST method accepts all the referrals, crediting each
+        referrer with the points of all its referrals.
+        """
+
+        target_cpfs = [referral.target_cpf for referral in self.referrals]
+        target_cpfs.append(self.other_referral.target_cpf)
+
+        response = self.client.post(self.URL, json={'target_cpfs': target_cpfs})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'accepted': 4,
+            'results': [{'target_cpf': cpf, 'accepted': True} for cpf in target_cpfs]})
+
+        client = Client.objects.get(cpf="11987098390")
+        self.other.refresh_from_db()
+        self.assertEqual((client.points, client.referrals_pending,
+                          client.referrals_accepted), (30, 0, 3))
+        self.assertEqual((self.other.points, self.other.referrals_pending,
+                          self.other.referrals_accepted), (10, 0, 1))
+        self.assertEqual(PointTransaction.objects.count(), 4)
+        self.assertFalse(Referral.objects.filter(status=False).exists())
+
+    def test_should_report_the_result_of_each_item(self):
+        """
+        Testing if invalid, repeated, unknown, expired and already accepted
+        CPFs are reported one by one, without failing the valid ones.
+        """
+
+        expired_date = (datetime.now() - timedelta(days=31)).astimezone()
+        with freeze_time(expired_date.isoformat()):
+            expired = create_referral()
+        accepted, pending = self.referrals[0], self.referrals[1]
+        Referral.objects.filter(id=accepted.id).update(status=True)
+        unknown_cpf = generate_valid_cpf()
+
+        response = self.client.post(self.URL, json={'target_cpfs': [
+            pending.target_cpf, '12345678900', pending.target_cpf,
+            unknown_cpf, expired.target_cpf, accepted.target_cpf]})
+
+        no_referral = 'No active referral registered for this CPF'
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'accepted': 1, 'results': [
+            {'target_cpf': pending.target_cpf, 'accepted': True},
+            {'target_cpf': '12345678900', 'accepted': False, 'error': 'Invalid CPF number.'},
+            {'target_cpf': pending.target_cpf, 'accepted': False,
+             'error': 'CPF repeated on the request'},
+            {'target_cpf': unknown_cpf, 'accepted': False, 'error': no_referral},
+            {'target_cpf': expired.target_cpf, 'accepted': False, 'error': no_referral},
+            {'target_cpf': accepted.target_cpf, 'accepted': False,
+             'error': 'Referral was already accepted'},
+        ]})
+        self.assertEqual(Client.objects.get(cpf="11987098390").points, 10)
+
+    def test_should_return_400_for_invalid_body(self):
+        """
+        Testing if the POST method returns a 400 response without a list of
+        CPFs, or with too many of them.
+        """
+
+        response = self.client.post(self.URL, json={'target_cpfs': []})
+        self.assertEqual(response.status_code, 400)
+
+        with self.settings(REFERRAL_BULK_MAX_ITEMS=2):
+            response = self.client.post(self.URL, json={'target_cpfs': ['1', '2', '3']})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,147 @@
+from freezegun import freeze_time
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from rest_framework.test import RequestsClient
+
+from ...membership import referred_cpfs
+from ...models import REFERRAL_POINTS, Client, PointTransaction, Referral
+from ..utils import create_referral, create_user, generate_valid_cpf
+
+
+class TestBulkCreateReferralsView(TestCase):
+    """
+    Testing the methods on the 'create-referrals/' endpoint.
+    """
+
+    URL = 'http://127.0.0.1:8000/create-referrals/'
+
+    def setUp(self):
+        """
+        Initializing the RequestsClient for all tests, as well as creating
+        an user.
+        """
+
+        self.client = RequestsClient()
+        create_user()
+
+    def test_should_create_referrals_and_update_counters_once(self):
+        """
+        Testing if the POST method creates a referral to each target and
+        counts them on the referrer.
+        """
+
+        target_cpfs = list({generate_valid_cpf() for _ in range(20)} - {'11987098390'})
+
+        response = self.client.post(self.URL, json={
+            'source_cpf': '119.870.983-90', 'target_cpfs': target_cpfs})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'created': len(target_cpfs),
+            'results': [{'target_cpf': cpf, 'created': True} for cpf in target_cpfs]})
+        self.assertEqual(
+            sorted(Referral.objects.filter(status=False).values_list('target_cpf', flat=True)),
+            sorted(target_cpfs))
+        client = Client.objects.get(cpf="11987098390")
+        self.assertEqual((client.referrals_total, client.referrals_pending),
+                         (len(target_cpfs), len(target_cpfs)))
+        self.assertTrue(all(referred_cpfs.might_contain(cpf) for cpf in target_cpfs))
+
+    def test_should_credit_referrals_created_as_accepted(self):
+        """
+        Testing if the referrals created already accepted credit the
+        referrer, with a ledger transaction each.
+        """
+
+        target_cpfs = list({generate_valid_cpf() for _ in range(3)} - {'11987098390'})
+
+        response = self.client.post(self.URL, json={
+            'source_cpf': '11987098390', 'target_cpfs': target_cpfs, 'status': True})
+
+        self.assertEqual(response.json()['created'], len(target_cpfs))
+        client = Client.objects.get(cpf="11987098390")
+        self.assertEqual((client.referrals_total, client.referrals_pending,
+                          client.referrals_accepted), (len(target_cpfs), 0, len(target_cpfs)))
+        self.assertEqual(client.points, REFERRAL_POINTS * len(target_cpfs))
+        self.assertEqual(
+            sorted(PointTransaction.objects.values_list('referral__target_cpf', flat=True)),
+            sorted(target_cpfs))
+
+    def test_should_report_target_referred_by_another_process(self):
+        """
+        Testing if a target missing from the membership filter, as if it
+        had been referred by another process, is reported as already
+        referred, and the other targets are still created.
+        """
+
+        referred_cpfs.build()
+        referred, new_cpf = generate_valid_cpf(), generate_valid_cpf()
+        Referral.objects.bulk_create([Referral(source_cpf_id="11987098390", target_cpf=referred)])
+        self.assertFalse(referred_cpfs.might_contain(referred))
+
+        response = self.client.post(self.URL, json={
+            'source_cpf': '11987098390', 'target_cpfs': [referred, new_cpf]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'created': 1, 'results': [
+            {'target_cpf': referred, 'created': False,
+             'error': 'error: This person was already referred.'},
+            {'target_cpf': new_cpf, 'created': True}]})
+        self.assertTrue(Referral.objects.filter(target_cpf=new_cpf).exists())
+
+    def test_should_report_the_result_of_each_target(self):
+        """
+        Testing if invalid, repeated, registered, already referred and self
+        referring CPFs are reported one by one with the errors of the single
+        endpoint, without failing the others, and if an expired referral is
+        replaced.
+        """
+
+        expired_date = (datetime.now() - timedelta(days=31)).astimezone()
+        with freeze_time(expired_date.isoformat()):
+            expired = create_referral()
+        referred = create_referral()
+        registered = Client.objects.create(
+            cpf=generate_valid_cpf(), name="Ana", phone="31998877554", email="ana@gmail.com")
+        new_cpf = generate_valid_cpf()
+
+        response = self.client.post(self.URL, json={
+            'source_cpf': '11987098390', 'target_cpfs': [
+                new_cpf, '12345678900', new_cpf, '11987098390',
+                registered.cpf, referred.target_cpf, expired.target_cpf]})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'created': 2, 'results': [
+            {'target_cpf': new_cpf, 'created': True},
+            {'target_cpf': '12345678900', 'created': False,
+             'error': 'Invalid CPF number.'},
+            {'target_cpf': new_cpf, 'created': False,
+             'error': 'CPF repeated on the request'},
+            {'target_cpf': '11987098390', 'created': False,
+             'error': 'error: User cannot refer themselves'},
+            {'target_cpf': registered.cpf, 'created': False,
+             'error': 'error: Referred person is already registered'},
+            {'target_cpf': referred.target_cpf, 'created': False,
+             'error': 'error: This person was already referred.'},
+            {'target_cpf': expired.target_cpf, 'created': True},
+        ]})
+        self.assertFalse(Referral.objects.filter(id=expired.id).exists())
+        self.assertEqual(Referral.objects.count(), 3)
+
+    def test_should_return_404_if_referrer_is_unregistered(self):
+        """
+        Testing if the POST method returns a 404 response, without creating
+        any referral, if the referrer isn't registered, and a 400 response
+        if its CPF is invalid.
+        """
+
+        response = self.client.post(self.URL, json={
+            'source_cpf': generate_valid_cpf(), 'target_cpfs': [generate_valid_cpf()]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json(), ["error: User must be registered to make a referral"])
+
+        response = self.client.post(self.URL, json={
+            'source_cpf': '12345678900', 'target_cpfs': [generate_valid_cpf()]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Referral.objects.exists())
@@ -0,0 +1,106 @@
+from unittest.mock import ANY
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import RequestsClient
+
+from ...membership import client_cpfs
+from ...models import Client
+from ..utils import create_user, generate_valid_cpf
+
+
+class TestBulkCreateUsersView(TestCase):
+    """
+    Testing the methods on the 'users/' endpoint.
+    """
+
+    URL = 'http://127.0.0.1:8000/users/'
+
+    def setUp(self):
+        """
+        Initializing the RequestsClient for all tests, as well as creating
+        an user.
+        """
+
+        self.client = RequestsClient()
+        create_user()
+
+    @staticmethod
+    def new_client(cpf):
+        return {'cpf': cpf, 'name': 'José Coelho', 'phone': '11956555877',
+                'email': 'jose.coelho@gmail.com'}
+
+    def test_should_create_clients_with_one_lookup_and_one_insert(self):
+        """
+        Testing if the POST method creates all the clients, looking up the
+        registered CPFs with one query and inserting them with another.
+        """
+
+        cpfs = []
+        while len(cpfs) < 50:
+            cpf = generate_valid_cpf()
+            if cpf not in cpfs and cpf != '11987098390':
+                cpfs.append(cpf)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(self.URL, json={
+                'clients': [self.new_client(cpf) for cpf in cpfs]})
+
+        queries = [query['sql'] for query in context.captured_queries
+                   if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 50)
+        self.assertEqual(response.json()['results'],
+                         [{'cpf': cpf, 'created': True} for cpf in cpfs])
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(Client.objects.count(), 51)
+        self.assertTrue(all(client_cpfs.might_contain(cpf) for cpf in cpfs))
+
+    def test_should_report_the_errors_of_each_client(self):
+        """
+        Testing if invalid, registered and repeated clients are reported one
+        by one, without failing the valid ones.
+        """
+
+        cpf = generate_valid_cpf()
+        response = self.client.post(self.URL, json={'clients': [
+            self.new_client(cpf),
+            self.new_client('12345678900'),
+            self.new_client('11987098390'),
+            self.new_client(cpf),
+            {**self.new_client(generate_valid_cpf()), 'email': 'jose'},
+            'José Coelho']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'created': 1, 'rows_per_second': response.json()['rows_per_second'],
+            'results': [
+                {'cpf': cpf, 'created': True},
+                {'cpf': '12345678900', 'created': False,
+                 'errors': {'cpf': ['Invalid CPF number.']}},
+                {'cpf': '11987098390', 'created': False,
+                 'errors': {'cpf': ['client with this CPF  already exists.']}},
+                {'cpf': cpf, 'created': False,
+                 'errors': {'cpf': ['CPF repeated on the import.']}},
+                {'cpf': ANY, 'created': False,
+                 'errors': {'email': ['Enter a valid email address.']}},
+                {'cpf': None, 'created': False, 'errors': {'non_field_errors': [
+                    'Invalid data. Expected a dictionary, but got str.']}},
+            ]})
+        self.assertEqual(Client.objects.count(), 2)
+
+    def test_should_return_400_for_invalid_body(self):
+        """
+        Testing if the POST method returns a 400 response if the clients
+        aren't a list, or are too many.
+        """
+
+        response = self.client.post(self.URL, json={'clients': {}})
+        self.assertEqual(response.status_code, 400)
+
+        with self.settings(CLIENT_BULK_MAX_ITEMS=1):
+            response = self.client.post(self.URL, json={'clients': [
+                self.new_client(generate_valid_cpf()) for _ in range(2)]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Client.objects.count(), 1)
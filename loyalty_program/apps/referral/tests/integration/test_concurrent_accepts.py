@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.db.models import Sum
+from django.test import TransactionTestCase
+
+from ...models import REFERRAL_POINTS, Client, PointTransaction, Referral
+from ...utils import set_referral_status
+from ..utils import create_referral, create_user
+
+
+class TestConcurrentAccepts(TransactionTestCase):
+    """
+    Stress test of the point crediting of the 'accept-referral/' endpoint:
+    many threads accept the same referrals at the same time, each one with
+    its own database connection, and each referral must be credited exactly
+    once.
+    """
+
+    # REFERRALS is coprime with THREADS, so every thread gets every referral
+    REFERRALS = 125
+    ACCEPTS_PER_REFERRAL = 32
+    THREADS = 16
+
+    def setUp(self):
+        """
+        Creating an user and its pending referrals, with the counters set.
+        """
+
+        create_user()
+        self.target_cpfs = [create_referral().target_cpf
+                            for _ in range(self.REFERRALS)]
+        Client.objects.filter(cpf="11987098390").update(
+            referrals_total=self.REFERRALS, referrals_pending=self.REFERRALS)
+
+    def accept_all(self, target_cpfs):
+        """
+        Accepts the referrals like the PUT on 'accept-referral/' does, from a
+        worker thread, returning how many of them this thread credited.
+        """
+
+        try:
+            credited = 0
+            for target_cpf in target_cpfs:
+                referral = Referral.active.get(target_cpf=target_cpf)
+                credited += set_referral_status(referral, True)
+            return credited
+        finally:
+            connection.close()
+
+    def test_should_credit_each_referral_once(self):
+        """
+        Testing if thousands of concurrent accepts leave the exact balance
+        and counters on the referrer, without lost or repeated credits.
+        """
+
+        requests = self.target_cpfs * self.ACCEPTS_PER_REFERRAL
+        shares = [requests[i::self.THREADS] for i in range(self.THREADS)]
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            credited = sum(executor.map(self.accept_all, shares))
+
+        client = Client.objects.get(cpf="11987098390")
+
+        self.assertEqual(credited, self.REFERRALS)
+        self.assertEqual(client.points, self.REFERRALS * REFERRAL_POINTS)
+        self.assertEqual(
+            PointTransaction.objects.aggregate(total=Sum('amount'))['total'],
+            client.points)
+        self.assertEqual(client.referrals_accepted, self.REFERRALS)
+        self.assertEqual(client.referrals_pending, 0)
+        self.assertFalse(Referral.objects.filter(status=False).exists())
@@ -1,10 +1,13 @@
 from freezegun import freeze_time
-from datetime import datetime
+from datetime import datetime, timedelta
+import uuid
 
+from django.core.cache import cache
 from django.test import TestCase
 from rest_framework.test import RequestsClient
 
-from ...models import Referral, Client
+from ...membership import referred_cpfs
+from ...models import REFERRAL_POINTS, PointTransaction, Referral, Client
 from ..utils import create_user, generate_valid_cpf
 
 
@@ -72,6 +75,69 @@ class TestCreateReferralView(TestCase):
         self.assertEqual(Referral.objects.count(), 1)
         self.assertEqual(json_response, expected_json_response)
 
+        client = Client.objects.get(cpf="11987098390")
+        self.assertEqual(client.referrals_total, 1)
+        self.assertEqual(client.referrals_pending, 1)
+        self.assertEqual(client.referrals_accepted, 0)
+
+    def test_should_credit_referral_created_as_accepted(self):
+        """
+        Testing if a referral created already accepted credits its referrer,
+        with a ledger transaction, and can't be credited again.
+        """
+
+        URL = 'http://127.0.0.1:8000/create-referral/'
+        target_cpf = generate_valid_cpf()
+        body = {'source_cpf': '11987098390', 'target_cpf': target_cpf, 'status': True}
+
+        response = self.client.post(URL, body)
+
+        self.assertEqual(response.status_code, 201)
+        client = Client.objects.get(cpf="11987098390")
+        self.assertEqual((client.referrals_total, client.referrals_pending,
+                          client.referrals_accepted), (1, 0, 1))
+        self.assertEqual(client.points, REFERRAL_POINTS)
+        self.assertEqual(PointTransaction.objects.get().referral.target_cpf, target_cpf)
+
+        self.client.put(f'http://127.0.0.1:8000/accept-referral/{target_cpf}/',
+                        json={'source_cpf': '11987098390', 'target_cpf': target_cpf,
+                              'status': True})
+        self.assertEqual(Client.objects.get(cpf="11987098390").points, REFERRAL_POINTS)
+
+    def test_should_replay_response_of_idempotency_key(self):
+        """
+        Testing if a retry with the same Idempotency-Key gets the first
+        response back, with only the lookup of the key and without creating
+        another referral, even after the caches were filled, and if the key
+        can't be used with another body.
+        """
+
+        URL = 'http://127.0.0.1:8000/create-referral/'
+        headers = {'Idempotency-Key': str(uuid.uuid4())}
+        body = {'source_cpf': '11987098390', 'target_cpf': generate_valid_cpf(),
+                'status': False}
+
+        response = self.client.post(URL, body, headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        # more entries than a cache keeps
+        cache.set_many({f'pressure:{i}': i for i in range(1000)})
+        with self.assertNumQueries(1):
+            replayed = self.client.post(URL, body, headers=headers)
+        self.assertEqual(replayed.status_code, 201)
+        self.assertEqual(replayed.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(replayed.json(), response.json())
+        self.assertEqual(Referral.objects.count(), 1)
+        self.assertEqual(Client.objects.get().referrals_total, 1)
+
+        response = self.client.post(URL, {**body, 'target_cpf': generate_valid_cpf()},
+                                    headers=headers)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Referral.objects.count(), 1)
+
+        response = self.client.post(URL, body)
+        self.assertEqual(response.status_code, 400)
+
     def test_should_return_404_if_referrer_is_unregistered(self):
         """
         Testing if the POST method on endpoint returns a 404 response if 
@@ -155,7 +221,7 @@ class TestCreateReferralView(TestCase):
 
         target_cpf = generate_valid_cpf()
         Referral.objects.create(
-            source_cpf="11987098390",
+            source_cpf_id="11987098390",
             target_cpf=target_cpf,
             status=False
         )
@@ -175,6 +241,36 @@ class TestCreateReferralView(TestCase):
         self.assertEqual(Referral.objects.count(), 1)
         self.assertEqual(json_response, expected_json_response)
 
+    def test_should_return_400_if_referent_was_referred_by_another_process(self):
+        """
+        Testing if the POST method on endpoint still returns a 400 response
+        for a target that is missing from the membership filter, as if the
+        referral had been created by another process.
+        """
+
+        referred_cpfs.build()
+        target_cpf = generate_valid_cpf()
+        Referral.objects.bulk_create([Referral(
+            source_cpf_id="11987098390",
+            target_cpf=target_cpf,
+            status=False
+        )])
+        self.assertFalse(referred_cpfs.might_contain(target_cpf))
+
+        URL = 'http://127.0.0.1:8000/create-referral/'
+        body = {
+            'source_cpf': 11987098390,
+            'target_cpf': target_cpf,
+            'status': False
+        }
+
+        response = self.client.post(URL, body)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Referral.objects.count(), 1)
+        self.assertEqual(response.json(), 'error: This person was already referred.')
+        self.assertEqual(Client.objects.get().referrals_total, 0)
+
     def test_should_Return_400_if_referring_invalid_cpf(self):
         """
         Testing if the POST method on endpoint returns a 400 response if 
@@ -196,3 +292,39 @@ class TestCreateReferralView(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(Referral.objects.count(), 0)
         self.assertEqual(json_response, expected_json_response)
+
+        for target_cpf in ('abc', '1' * 22):
+            body['target_cpf'] = target_cpf
+            response = self.client.post(URL, body)
+
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('target_cpf', response.json())
+
+
+    def test_should_post_referral_over_expired_referral_with_201(self):
+        """
+        Testing if the POST method on endpoint creates the referral when
+        the person only has an expired referral, not yet deleted.
+        """
+
+        target_cpf = generate_valid_cpf()
+        expired_date = datetime.now() - timedelta(days=31)
+        with freeze_time(expired_date.astimezone().isoformat()):
+            Referral.objects.create(
+                source_cpf_id="11987098390",
+                target_cpf=target_cpf,
+                status=False
+            )
+
+        URL = 'http://127.0.0.1:8000/create-referral/'
+        body = {
+            'source_cpf': 11987098390,
+            'target_cpf': target_cpf,
+            'status': False
+        }
+
+        response = self.client.post(URL, body)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Referral.objects.count(), 1)
+        self.assertEqual(Referral.active.count(), 1)
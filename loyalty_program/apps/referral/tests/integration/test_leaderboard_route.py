@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.test import TestCase
+from rest_framework.test import RequestsClient
+
+from ...leaderboard import leaderboard
+from ...models import Client
+from ...utils import set_referral_status
+from ..utils import create_referral, create_user, generate_valid_cpf
+
+
+class TestLeaderboardView(TestCase):
+    """
+    Testing the methods on the 'leaderboard/' endpoints.
+    """
+
+    def setUp(self):
+        """
+        Initializing the RequestsClient for all tests, as well as creating
+        three users with different points and a fresh leaderboard cache.
+        """
+
+        self.client = RequestsClient()
+        leaderboard.invalidate()
+        create_user()
+        Client.objects.filter(cpf="11987098390").update(points=20)
+        self.ana = Client.objects.create(cpf=generate_valid_cpf(), name="Ana",
+                                         phone="31998877554", email="ana@gmail.com")
+        Client.objects.filter(cpf=self.ana.cpf).update(points=30)
+        self.bia = Client.objects.create(cpf=generate_valid_cpf(), name="Bia",
+                                         phone="31998877554", email="bia@gmail.com")
+
+    def test_should_return_top_clients_with_200(self):
+        """
+        Testing if the GET method returns the clients with points, ranked,
+        and up to the requested limit.
+        """
+
+        response = self.client.get('http://127.0.0.1:8000/leaderboard/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'rank': 1, 'cpf': self.ana.cpf, 'name': 'Ana', 'points': 30},
+            {'rank': 2, 'cpf': '11987098390', 'name': 'Luisa Souza', 'points': 20},
+        ])
+
+        response = self.client.get('http://127.0.0.1:8000/leaderboard/?limit=1')
+        self.assertEqual([entry['cpf'] for entry in response.json()], [self.ana.cpf])
+
+    def test_should_serve_cache_and_apply_credits(self):
+        """
+        Testing if the leaderboard is served from memory, and if the credits
+        are applied to it once the transaction commits.
+        """
+
+        leaderboard.top(10)
+        with self.assertNumQueries(0):
+            self.client.get('http://127.0.0.1:8000/leaderboard/')
+
+        referral = create_referral()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                set_referral_status(referral, True)
+                set_referral_status(create_referral(), True)
+
+        with self.assertNumQueries(0):
+            response = self.client.get('http://127.0.0.1:8000/leaderboard/')
+        self.assertEqual(response.json()[0], {
+            'rank': 1, 'cpf': '11987098390', 'name': 'Luisa Souza', 'points': 40})
+
+    def test_should_reload_when_other_client_is_credited(self):
+        """
+        Testing if a credit to a client outside of the cached leaderboard
+        makes it reload.
+        """
+
+        leaderboard.top(10)
+        Client.objects.filter(cpf=self.bia.cpf).update(points=50)
+        leaderboard.record_credits({self.bia.cpf: 50})
+
+        top = leaderboard.top(10)
+        self.assertEqual([entry['cpf'] for entry in top],
+                         [self.bia.cpf, self.ana.cpf, '11987098390'])
+
+    def test_should_return_client_rank(self):
+        """
+        Testing if the GET method on 'leaderboard/<cpf>/' returns the rank of
+        the client, or 404 for an unregistered one.
+        """
+
+        response = self.client.get('http://127.0.0.1:8000/leaderboard/11987098390/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'cpf': '11987098390', 'rank': 2, 'points': 20})
+
+        response = self.client.get(f'http://127.0.0.1:8000/leaderboard/{self.bia.cpf}/')
+        self.assertEqual(response.json()['rank'], 3)
+
+        response = self.client.get(f'http://127.0.0.1:8000/leaderboard/{generate_valid_cpf()}/')
+        self.assertEqual(response.status_code, 404)
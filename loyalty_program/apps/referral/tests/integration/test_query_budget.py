@@ -0,0 +1,114 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import RequestsClient
+
+from ...leaderboard import leaderboard
+from ...membership import client_cpfs, referred_cpfs
+from ...models import Client, Referral
+from ..utils import create_referral, create_user, generate_valid_cpf
+
+
+class TestQueryBudget(TestCase):
+    """
+    Pins the maximum number of SQL queries each route in urls.py may issue,
+    so a change that adds round-trips to an endpoint fails here instead of
+    silently slowing it down. SAVEPOINT/RELEASE statements of atomic blocks
+    are not counted.
+    """
+
+    def setUp(self):
+        """
+        Initializing the RequestsClient, creating an user and a referral
+        for all tests, and building the membership filters, which is done
+        in the background when a process starts serving.
+        """
+
+        self.client = RequestsClient()
+        create_user()
+        self.referral = create_referral()
+        for membership in (client_cpfs, referred_cpfs):
+            membership.build()
+
+    def assertMaxQueries(self, budget, method, path, data=None, json=None):
+        """
+        Calls the route and checks that it used at most `budget` queries.
+        """
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.request(
+                method, f'http://127.0.0.1:8000{path}', data=data, json=json)
+
+        queries = [query['sql'] for query in context.captured_queries
+                   if 'SAVEPOINT' not in query['sql']]
+        self.assertLess(response.status_code, 500)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{method.upper()} {path} used {len(queries)} queries:\n' + '\n'.join(queries))
+
+    def test_main_page_budget(self):
+        self.assertMaxQueries(0, 'get', '/')
+
+    def test_user_routes_budget(self):
+        self.assertMaxQueries(0, 'get', '/user/')
+        self.assertMaxQueries(1, 'post', '/user/', {
+            'cpf': generate_valid_cpf(), 'name': 'José Coelho',
+            'phone': '11956555877', 'email': 'jose.coelho@gmail.com'})
+        self.assertMaxQueries(1, 'get', '/user/11987098390/')
+        self.assertMaxQueries(0, 'get', '/user/11987098390/')
+        self.assertMaxQueries(3, 'put', '/user/11987098390/', {
+            'cpf': '11987098390', 'name': 'Luisa Souza',
+            'phone': '31998877554', 'email': 'luisa_souza@gmail.com'})
+
+    def test_bulk_create_users_budget(self):
+        clients = [{'cpf': cpf, 'name': 'José Coelho', 'phone': '11956555877',
+                    'email': 'jose.coelho@gmail.com'}
+                   for cpf in ['11987098390'] + [generate_valid_cpf() for _ in range(20)]]
+        self.assertMaxQueries(2, 'post', '/users/', json={'clients': clients})
+        self.assertEqual(Client.objects.count(), 21)
+
+    def test_referral_listing_routes_budget(self):
+        # a cached response costs the lookup of its generation
+        self.assertMaxQueries(2, 'get', '/all-referrals/')
+        self.assertMaxQueries(1, 'get', '/all-referrals/')
+        self.assertMaxQueries(1, 'get', '/all-referrals/?stream=1')
+        self.assertMaxQueries(3, 'get', '/all-referrals/11987098390/')
+        self.assertMaxQueries(1, 'get', '/all-referrals/11987098390/')
+        self.assertMaxQueries(2, 'get', f'/referral/{self.referral.target_cpf}/')
+        self.assertMaxQueries(1, 'get', f'/referral/{self.referral.target_cpf}/')
+
+    def test_create_referral_budget(self):
+        self.assertMaxQueries(0, 'get', '/create-referral/')
+        self.assertMaxQueries(4, 'post', '/create-referral/', {
+            'source_cpf': '11987098390', 'target_cpf': generate_valid_cpf(),
+            'status': False})
+
+    def test_bulk_create_referrals_budget(self):
+        self.assertMaxQueries(5, 'post', '/create-referrals/', {
+            'source_cpf': '11987098390',
+            'target_cpfs': [self.referral.target_cpf] + [generate_valid_cpf() for _ in range(20)]})
+        self.assertEqual(Referral.objects.count(), 21)
+
+    def test_accept_referral_budget(self):
+        path = f'/accept-referral/{self.referral.target_cpf}/'
+        self.assertMaxQueries(1, 'get', path)
+        self.assertMaxQueries(5, 'put', path, {
+            'source_cpf': '11987098390',
+            'target_cpf': self.referral.target_cpf, 'status': True})
+        self.assertTrue(Referral.objects.get(id=self.referral.id).status)
+
+    def test_bulk_accept_referrals_budget(self):
+        target_cpfs = [self.referral.target_cpf] + [
+            create_referral().target_cpf for _ in range(4)]
+        self.assertMaxQueries(5, 'post', '/accept-referrals/',
+                              {'target_cpfs': target_cpfs})
+        self.assertFalse(Referral.objects.filter(status=False).exists())
+
+    def test_cache_stats_budget(self):
+        self.assertMaxQueries(0, 'get', '/cache-stats/')
+
+    def test_leaderboard_budget(self):
+        leaderboard.invalidate()
+        self.assertMaxQueries(1, 'get', '/leaderboard/')
+        self.assertMaxQueries(0, 'get', '/leaderboard/')
+        self.assertMaxQueries(2, 'get', '/leaderboard/11987098390/')
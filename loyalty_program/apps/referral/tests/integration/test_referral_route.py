@@ -1,12 +1,14 @@
 from freezegun import freeze_time
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import ANY
 
 from django.test import TestCase
 from rest_framework.test import RequestsClient
 
+from ...cache import referral_cache
 from ...models import Referral
-from ..utils import create_user, generate_valid_cpf
+from ...utils import set_referral_status
+from ..utils import create_referral, create_user, generate_valid_cpf
 
 
 class TestReferralView(TestCase):
@@ -32,7 +34,7 @@ class TestReferralView(TestCase):
         with freeze_time(creation_time):
             create_user()
             Referral.objects.create(
-                source_cpf="11987098390",
+                source_cpf_id="11987098390",
                 target_cpf=target_cpf,
                 status=False
             )
@@ -66,3 +68,42 @@ class TestReferralView(TestCase):
 
         self.assertEqual(response.status_code, 404)
         self.assertEqual(json_response, expected_json_response)
+
+    def test_should_return_304_while_referral_is_unchanged(self):
+        """
+        Testing if the GET method returns the ETag and Last-Modified of the
+        referral, and a 304 response for a client that already has it,
+        from the cache or from one query (plus the lookup of the cache
+        generation), until the referral changes.
+        """
+
+        create_user()
+        referral = create_referral()
+        URL = f'http://127.0.0.1:8000/referral/{referral.target_cpf}/'
+
+        response = self.client.get(URL)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        referral_cache.bump([])
+        with self.assertNumQueries(2):
+            response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(URL, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(URL + '?fields=status', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        with freeze_time(datetime.now().astimezone() + timedelta(seconds=5)):
+            set_referral_status(referral, True)
+        response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertTrue(response.json()[0]['status'])
@@ -1,11 +1,15 @@
 from freezegun import freeze_time
-from datetime import datetime
+from datetime import datetime, timedelta
+import uuid
 
 from django.test import TestCase
 from rest_framework.test import RequestsClient
 
-from ..utils import generate_valid_cpf, create_user
+from ..utils import generate_valid_cpf, create_referral, create_user
+from ...cache import client_cache
+from ...membership import client_cpfs
 from ...models import Client
+from ...utils import set_referral_status
 
 
 class TestMainPage(TestCase):
@@ -25,11 +29,17 @@ class TestMainPage(TestCase):
         """
         response = self.client.get('http://127.0.0.1:8000')
         expected_json = {'User detail and update': 'user/<str:cpf>/',
+                         'Create many users at once': 'users/',
                          'List of all referrals registered': 'all-referrals/',
                          'List of all referrals performed by an user registered': 'all-referrals/<str:cpf>/',
                          'Information on specific referral': 'referral/<str:cpf>/',
                          'Create new referral': 'create-referral/',
+                         'Create many referrals at once': 'create-referrals/',
                          'Accept specific referral': 'accept-referral/<str:cpf>/',
+                         'Accept many referrals at once': 'accept-referrals/',
+                         'Clients with the most points': 'leaderboard/',
+                         'Position of an user on the leaderboard': 'leaderboard/<str:cpf>/',
+                         'Cache hit and miss counters': 'cache-stats/',
                          }
 
         self.assertEqual(response.status_code, 200)
@@ -68,12 +78,30 @@ class TestUpdateUserView(TestCase):
             "cpf": "11987098390", "name": "Luisa Souza",
             "phone": "31998877554", "email": "luisa@gmail.com",
             "created_at": self.creation_time,
-            "updated_at": self.creation_time, "points": 0
+            "updated_at": self.creation_time, "points": 0,
+            "referrals_total": 0, "referrals_pending": 0,
+            "referrals_accepted": 0
         }
 
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json_response, expected_json_response)
 
+    def test_should_retrieve_only_requested_user_fields(self):
+        """
+        Testing if the GET method returns only the fields on the 'fields'
+        query parameter.
+        """
+
+        URL = 'http://127.0.0.1:8000/user/11987098390/?fields=name,points'
+
+        response = self.client.get(URL)
+        json_response = response.json()
+
+        expected_json_response = {"name": "Luisa Souza", "points": 0}
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json_response, expected_json_response)
+
     def test_should_return_404_for_nonexisting_client(self):
         """
         Testing if the API returns a 'not found' response when trying to
@@ -91,6 +119,65 @@ class TestUpdateUserView(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertEqual(json_response, expected_json_response)
 
+    def test_should_serve_user_from_cache_until_it_changes(self):
+        """
+        Testing if the second GET is served from the cache, without queries,
+        and if updating the user or crediting points invalidates it.
+        """
+
+        URL = 'http://127.0.0.1:8000/user/11987098390/'
+        hits = client_cache.hits
+
+        self.assertEqual(self.client.get(URL).headers['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(URL + '?fields=name,points')
+        self.assertEqual(response.headers['X-Cache'], 'HIT')
+        self.assertEqual(response.json(), {"name": "Luisa Souza", "points": 0})
+        self.assertEqual(client_cache.hits, hits + 1)
+
+        self.client.put(URL, {'cpf': '11987098390', 'name': 'Luisa Souza Lima'})
+        response = self.client.get(URL)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'Luisa Souza Lima')
+
+        set_referral_status(create_referral(), True)
+        response = self.client.get(URL)
+        self.assertEqual(response.headers['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['points'], 10)
+
+        # a read that started before a write can't cache the old payload
+        key = client_cache.key('119.870.983-90')
+        client_cache.invalidate(['11987098390'])
+        client_cache.set(key, {'name': 'Luisa Souza'})
+        self.assertEqual(self.client.get(URL).headers['X-Cache'], 'MISS')
+
+    def test_should_return_304_while_user_is_unchanged(self):
+        """
+        Testing if the GET method returns the ETag and Last-Modified of the
+        user, and a 304 response for a client that already has it, from the
+        cache or from a single-column query, until the user changes.
+        """
+
+        URL = 'http://127.0.0.1:8000/user/11987098390/'
+        response = self.client.get(URL)
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        client_cache.invalidate(['11987098390'])
+        with self.assertNumQueries(1):
+            response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        with freeze_time(datetime.now().astimezone() + timedelta(seconds=5)):
+            set_referral_status(create_referral(), True)
+        response = self.client.get(URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
     def test_should_update_user_with_valid_input(self):
         """
         Testing if the PUT method on endpoint successfully updates the client
@@ -116,7 +203,10 @@ class TestUpdateUserView(TestCase):
                 "email": "luisa_souza@gmail.com",
                 "created_at": self.creation_time,
                 "updated_at": update_time,
-                "points": 0
+                "points": 0,
+                "referrals_total": 0,
+                "referrals_pending": 0,
+                "referrals_accepted": 0
             }
         }
 
@@ -238,7 +328,10 @@ class TestCreateUserView(TestCase):
                 "email": "jose.coelho@gmail.com",
                 "created_at": creation_time,
                 "updated_at": creation_time,
-                "points": 0
+                "points": 0,
+                "referrals_total": 0,
+                "referrals_pending": 0,
+                "referrals_accepted": 0
             }
         }
 
@@ -246,6 +339,34 @@ class TestCreateUserView(TestCase):
         self.assertEqual(Client.objects.count(), 1)
         self.assertEqual(json_response, expected_json_response)
 
+    def test_should_replay_response_of_idempotency_key(self):
+        """
+        Testing if a retry with the same Idempotency-Key gets the first
+        response back, errors included, with only the lookup of the key.
+        """
+
+        URL = 'http://127.0.0.1:8000/user/'
+        headers = {'Idempotency-Key': str(uuid.uuid4())}
+        body = {"cpf": "94353687433", "name": "José Coelho",
+                "phone": "11956555877", "email": "jose.coelho@gmail.com"}
+
+        response = self.client.post(URL, body, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        with self.assertNumQueries(1):
+            replayed = self.client.post(URL, body, headers=headers)
+        self.assertEqual(replayed.status_code, 201)
+        self.assertEqual(replayed.json(), response.json())
+        self.assertEqual(Client.objects.count(), 1)
+
+        headers = {'Idempotency-Key': str(uuid.uuid4())}
+        body['email'] = 'jose'
+        response = self.client.post(URL, body, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        with self.assertNumQueries(1):
+            replayed = self.client.post(URL, body, headers=headers)
+        self.assertEqual(replayed.status_code, 400)
+        self.assertEqual(replayed.json(), response.json())
+
     def test_should_return_400_if_client_is_already_registered(self):
         """
         Testing if the POST method on endpoint returns a 400 response if 
@@ -277,6 +398,35 @@ class TestCreateUserView(TestCase):
         self.assertEqual(Client.objects.count(), 1)
         self.assertEqual(json_response, expected_json_response)
 
+    def test_should_return_400_if_client_was_registered_by_another_process(self):
+        """
+        Testing if the POST method on endpoint still returns a 400 response
+        for a registered CPF that is missing from the membership filter, as
+        if it had been created by another process.
+        """
+
+        client_cpfs.build()
+        Client.objects.bulk_create([Client(
+            cpf="51805510649",
+            name="New cLient",
+            phone="31992818778",
+            email="client@gmail.com"
+        )])
+
+        URL = 'http://127.0.0.1:8000/user/'
+        body = {
+            "cpf": "51805510649",
+            "name": "José Coelho",
+            "phone": "11956555877",
+            "email": "jose.coelho@gmail.com"
+        }
+
+        response = self.client.post(URL, body)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Client.objects.get().name, "New cLient")
+        self.assertEqual(response.json(), {"cpf": ["client with this CPF  already exists."]})
+
     def test_should_Return_400_if_creating_user_with_invalid_cpf(self):
         """
         Testing if the POST method on endpoint returns a 400 response if 
@@ -346,3 +496,24 @@ class TestCreateUserView(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(Client.objects.count(), 0)
         self.assertEqual(json_response, expected_json_response)
+
+    def test_should_return_400_if_body_is_not_an_object(self):
+        """
+        Testing if the POST method on endpoint returns a 400 response, and
+        not a 500, if the body is a JSON array instead of an object.
+        """
+
+        client_cpfs.build()
+        URL = 'http://127.0.0.1:8000/user/'
+        body = [{
+            "cpf": "22052587292",
+            "name": "José Coelho",
+            "phone": "11956555877",
+            "email": "jose.coelho@gmail.com"
+        }]
+
+        response = self.client.post(URL, json=body)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Client.objects.count(), 0)
+        self.assertIn("non_field_errors", response.json())
@@ -1,7 +1,32 @@
-from django.test import TestCase
-
-from ..models import Client, Referral
-from ..serializers import ClientSerializer, ReferralSerializer
+from freezegun import freeze_time
+from io import StringIO
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import ProtectedError
+from django.db.utils import OperationalError
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from rest_framework.renderers import JSONRenderer
+
+from ..database import retry_on_lock, retry_outside_transaction
+from ..idempotency import idempotency_store
+from ..membership import CountingBloomFilter, MembershipFilter, client_cpfs, referred_cpfs
+from ..models import (REFERRAL_POINTS, Client, PointTransaction, Referral,
+                      ReferralArchive)
+from ..serializers import (ClientSerializer, FastReadSerializer,
+                           ReferralSerializer)
+from ..utils import (acquire_lock, archive_expired_referrals,
+                     delete_referrals_older_than_30_days, release_lock,
+                     set_referral_status, sweep_expired_referrals,
+                     update_referral_counters)
+from .utils import create_referral, create_user, generate_valid_cpf
 
 
 class TestClientsSerializer(TestCase):
@@ -147,8 +172,9 @@ class TestReferralModel(TestCase):
 
     @classmethod
     def setUpTestData(cls):
+        cls.referrer = create_user()
         cls.referral = Referral.objects.create(
-            source_cpf="11987098390",
+            source_cpf_id="11987098390",
             target_cpf="51805510649",
             status=False
         )
@@ -163,8 +189,535 @@ class TestReferralModel(TestCase):
 
         self.assertEqual(Referral.objects.count(), 1)
 
-        self.assertEqual(created_referral.source_cpf, '11987098390')
+        self.assertEqual(created_referral.source_cpf_id, '11987098390')
+        self.assertEqual(created_referral.source_cpf, self.referrer)
         self.assertEqual(created_referral.target_cpf, '51805510649')
         self.assertEqual(created_referral.status, False)
         self.assertIsNotNone(created_referral.created_at)
         self.assertIsNotNone(created_referral.updated_at)
+
+    def test_referral_requires_registered_referrer(self):
+        """
+        Testing if the database refuses a referral whose referrer is not
+        a registered client
+        """
+
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                Referral.objects.create(
+                    source_cpf_id=generate_valid_cpf(),
+                    target_cpf=generate_valid_cpf(),
+                    status=False
+                )
+                connection.check_constraints()
+
+
+class TestDeleteExpiredReferrals(TestCase):
+    """
+    Test class for unit testing the expired referrals purge
+    """
+
+    def setUp(self):
+        create_user()
+        expired_date = (datetime.now() - timedelta(days=31)).astimezone()
+        with freeze_time(expired_date.isoformat()):
+            for _ in range(5):
+                Referral.objects.create(
+                    source_cpf_id="11987098390",
+                    target_cpf=generate_valid_cpf(),
+                    status=False
+                )
+            self.accepted = Referral.objects.create(
+                source_cpf_id="11987098390",
+                target_cpf=generate_valid_cpf(),
+                status=True
+            )
+        self.active = Referral.objects.create(
+            source_cpf_id="11987098390",
+            target_cpf=generate_valid_cpf(),
+            status=False
+        )
+
+    def test_should_delete_only_expired_pending_referrals(self):
+        """
+        Testing if only pending referrals older than 30 days are deleted,
+        across several chunks, and if the number of deleted rows is returned
+        """
+
+        deleted, elapsed = delete_referrals_older_than_30_days(batch_size=2)
+
+        self.assertEqual(deleted, 5)
+        self.assertGreaterEqual(elapsed, 0)
+        self.assertEqual(
+            set(Referral.objects.values_list('id', flat=True)),
+            {self.accepted.id, self.active.id})
+
+    def test_should_not_sweep_while_lock_is_held(self):
+        """
+        Testing if the sweep is skipped while another worker holds the
+        database lock, and runs once the lock is released
+        """
+
+        self.assertTrue(acquire_lock('expire_referrals', 'other-worker', 60))
+        self.assertIsNone(sweep_expired_referrals())
+        self.assertEqual(Referral.objects.count(), 7)
+
+        release_lock('expire_referrals', 'other-worker')
+        archived, _ = sweep_expired_referrals()
+
+        self.assertEqual(archived, 5)
+        self.assertEqual(Referral.objects.count(), 2)
+
+    def test_should_extend_lock_after_each_chunk(self):
+        """
+        Testing if the sweep stops after a chunk when its lock can't be
+        extended, and if the sweeper keeps its lock chunk after chunk, even
+        past the TTL
+        """
+
+        archived, _ = archive_expired_referrals(batch_size=2, on_chunk=lambda: False)
+        self.assertEqual(archived, 2)
+
+        with self.settings(REFERRAL_SWEEP_LOCK_TTL=0):
+            archived, _ = sweep_expired_referrals(batch_size=1)
+        self.assertEqual(archived, 3)
+        self.assertTrue(acquire_lock('expire_referrals', 'other-worker', 60))
+
+    def test_should_move_expired_referrals_to_archive(self):
+        """
+        Testing if the expired referrals are moved, in chunks, to the
+        archive table with their original data
+        """
+
+        expired_ids = set(Referral.objects.expired().values_list('id', flat=True))
+        archived, _ = archive_expired_referrals(batch_size=2)
+
+        self.assertEqual(archived, 5)
+        self.assertEqual(Referral.objects.count(), 2)
+        self.assertEqual(
+            set(ReferralArchive.objects.values_list('original_id', flat=True)),
+            expired_ids)
+        self.assertFalse(ReferralArchive.objects.filter(status=True).exists())
+
+    def test_should_reject_chunks_over_the_sqlite_variable_limit(self):
+        """
+        Testing if the command refuses a batch size whose IN list of ids
+        would go over the 999 variables of older SQLite versions
+        """
+
+        with self.assertRaises(CommandError):
+            call_command('expire_referrals', '--batch-size', '1000', stdout=StringIO())
+        self.assertEqual(Referral.objects.count(), 7)
+
+
+class TestReferralCounters(TestCase):
+    """
+    Test class for unit testing the denormalized referral counters
+    """
+
+    def setUp(self):
+        self.client = create_user()
+        expired_date = (datetime.now() - timedelta(days=31)).astimezone()
+        with freeze_time(expired_date.isoformat()):
+            create_referral()
+            create_referral()
+        create_referral()
+        Referral.objects.filter(id=3).update(status=True)
+
+    def test_should_recompute_counters_with_repair_command(self):
+        """
+        Testing if the repair command recomputes the counters from the
+        referrals, and resets the ones of clients without referrals
+        """
+
+        other = Client.objects.create(cpf=generate_valid_cpf(), name="Ana",
+                                      phone="31998877554", email="ana@gmail.com")
+        update_referral_counters(other.cpf, total=4, pending=4)
+
+        call_command('repair_referral_counters', stdout=StringIO())
+
+        self.client.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.client.referrals_total, self.client.referrals_pending,
+                          self.client.referrals_accepted), (3, 2, 1))
+        self.assertEqual((other.referrals_total, other.referrals_pending,
+                          other.referrals_accepted), (0, 0, 0))
+
+    def test_should_discount_expired_referrals_on_sweep(self):
+        """
+        Testing if archiving or deleting expired referrals takes them out of
+        the counters of their referrer
+        """
+
+        call_command('repair_referral_counters', stdout=StringIO())
+        sweep_expired_referrals(batch_size=1)
+
+        self.client.refresh_from_db()
+        self.assertEqual((self.client.referrals_total, self.client.referrals_pending,
+                          self.client.referrals_accepted), (1, 0, 1))
+
+
+class TestPointsLedger(TestCase):
+    """
+    Test class for unit testing the points ledger and the balances
+    """
+
+    def setUp(self):
+        self.client = create_user()
+        self.referral = create_referral()
+
+    def test_should_write_ledger_on_credit_only_once(self):
+        """
+        Testing if accepting a referral appends one transaction to the
+        ledger, and accepting it again doesn't
+        """
+
+        self.assertTrue(set_referral_status(self.referral, True))
+        self.assertFalse(set_referral_status(self.referral, True))
+
+        transaction = PointTransaction.objects.get()
+        self.assertEqual(transaction.client_id, self.client.cpf)
+        self.assertEqual(transaction.referral_id, self.referral.id)
+        self.assertEqual(transaction.amount, REFERRAL_POINTS)
+        with self.assertRaises(ValueError):
+            transaction.save()
+
+        self.assertFalse(set_referral_status(self.referral, False))
+        self.assertTrue(Referral.objects.get(id=self.referral.id).status)
+        with self.assertRaises(IntegrityError):
+            PointTransaction.objects.create(
+                client=self.client, referral=self.referral, amount=REFERRAL_POINTS,
+                reason=PointTransaction.REFERRAL_ACCEPTED)
+
+    def test_should_not_delete_ledger_with_client(self):
+        """
+        Testing if a client with transactions on the ledger can't be deleted
+        """
+
+        set_referral_status(self.referral, True)
+
+        with self.assertRaises(ProtectedError):
+            self.client.delete()
+        self.assertEqual(PointTransaction.objects.count(), 1)
+
+    def test_should_register_ledger_read_only_on_admin(self):
+        """
+        Testing if the admin lists the ledger but can't add, change or delete
+        a transaction
+        """
+
+        set_referral_status(self.referral, True)
+        model_admin = admin.site._registry[PointTransaction]
+        request = RequestFactory().get('/admin/')
+        request.user = User(is_staff=True, is_superuser=True)
+        transaction = PointTransaction.objects.get()
+
+        self.assertTrue(model_admin.has_view_permission(request, transaction))
+        self.assertFalse(model_admin.has_add_permission(request))
+        self.assertFalse(model_admin.has_change_permission(request, transaction))
+        self.assertFalse(model_admin.has_delete_permission(request, transaction))
+
+    def test_should_rebuild_balances_from_ledger(self):
+        """
+        Testing if the rebuild command lists the balances that don't match
+        the ledger, and only fixes them without --dry-run
+        """
+
+        set_referral_status(self.referral, True)
+        Client.objects.filter(cpf=self.client.cpf).update(points=35)
+
+        output = StringIO()
+        call_command('rebuild_point_balances', '--dry-run', stdout=output)
+        self.client.refresh_from_db()
+        self.assertIn(f'{self.client.cpf}: balance 35, ledger {REFERRAL_POINTS}',
+                      output.getvalue())
+        self.assertEqual(self.client.points, 35)
+
+        call_command('rebuild_point_balances', stdout=StringIO())
+        self.client.refresh_from_db()
+        self.assertEqual(self.client.points, REFERRAL_POINTS)
+
+
+class TestFastReadSerializer(TestCase):
+    """
+    Test class for unit testing the values_list based read serializer
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        create_user()
+        with freeze_time('2021-12-21T18:50:30.000000+00:00'):
+            create_referral()
+        create_referral()
+        Referral.objects.filter(id=2).update(status=True)
+
+    def test_should_render_same_json_as_model_serializers(self):
+        """
+        Testing if the JSON rendered from the fast serializer is byte
+        identical to the one rendered from the model serializers, with all
+        fields and with only some of them
+        """
+
+        renderer = JSONRenderer()
+        cases = [(ClientSerializer, Client.objects.all(), None),
+                 (ReferralSerializer, Referral.objects.all(), None),
+                 (ReferralSerializer, Referral.objects.all(), ['status', 'created_at'])]
+
+        for serializer_class, queryset, fields in cases:
+            expected = serializer_class(queryset, many=True, fields=fields).data
+            serializer = FastReadSerializer(serializer_class, fields)
+            data = serializer.serialize(serializer.rows(queryset))
+
+            self.assertEqual(renderer.render(data), renderer.render(expected))
+
+
+class TestCompactCPFField(TestCase):
+    """
+    Test class for unit testing the integer CPF storage
+    """
+
+    def test_should_store_cpf_as_integer_and_return_string(self):
+        """
+        Testing if the CPF is stored as an integer, and read back as the
+        11-digit string with its leading zeros, from formatted input too
+        """
+
+        Client.objects.create(cpf="012.345.678-90", name="Ana", phone="31998877554",
+                              email="ana@gmail.com")
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT cpf FROM referral_client")
+            self.assertEqual(cursor.fetchone()[0], 1234567890)
+
+        client = Client.objects.get(cpf="01234567890")
+        self.assertEqual(client.cpf, "01234567890")
+        self.assertTrue(Client.objects.filter(cpf=1234567890).exists())
+        self.assertEqual(ClientSerializer(client).data['cpf'], "01234567890")
+
+    def test_should_match_nothing_looking_up_a_non_cpf(self):
+        """
+        Testing if a lookup by a value that isn't an 11-digit CPF matches
+        nothing instead of failing, and if saving it still fails
+        """
+
+        create_user()
+
+        for value in ("abc", "1" * 22, "119870983", 10 ** 11, -1):
+            self.assertFalse(Client.objects.filter(cpf=value).exists())
+        self.assertFalse(Client.objects.filter(cpf__in=["abc", "1" * 22]).exists())
+        self.assertTrue(Client.objects.filter(cpf__in=["abc", "119.870.983-90"]).exists())
+
+        with self.assertRaises(ValueError):
+            Client.objects.create(cpf="abc", name="Ana", phone="31998877554",
+                                  email="ana@gmail.com")
+
+
+class TestMembershipFilter(TestCase):
+    """
+    Test class for unit testing the membership filters of the CPFs
+    """
+
+    def test_should_never_miss_an_added_cpf(self):
+        """
+        Testing if the counting Bloom filter reports every added CPF, keeps
+        its false positive rate close to the configured one, and forgets
+        removed CPFs
+        """
+
+        bloom = CountingBloomFilter(capacity=10000, error_rate=0.01)
+        added = [f'{i * 7919 + 12345:011d}' for i in range(10000)]
+        for cpf in added:
+            bloom.add(cpf)
+
+        self.assertTrue(all(cpf in bloom for cpf in added))
+        others = [f'{i * 7919 + 12346:011d}' for i in range(10000)]
+        false_positives = sum(cpf in bloom for cpf in others) / len(others)
+        self.assertLess(false_positives, 0.02)
+        self.assertAlmostEqual(bloom.false_positive_rate(), 0.01, delta=0.002)
+
+        for cpf in added[:100]:
+            bloom.remove(cpf)
+        self.assertLess(sum(cpf in bloom for cpf in added[:100]), 10)
+        self.assertTrue(all(cpf in bloom for cpf in added[100:]))
+
+    def test_should_follow_inserts_and_sweeps(self):
+        """
+        Testing if the filters are built from the database, see the clients
+        and referrals created afterwards, in any CPF format, and forget the
+        referrals deleted by the sweep
+        """
+
+        create_user()
+        client_cpfs.reset()
+        referred_cpfs.reset()
+        self.assertTrue(client_cpfs.might_contain(generate_valid_cpf()))
+
+        client_cpfs.build()
+        referred_cpfs.build()
+        self.assertTrue(client_cpfs.might_contain("119.870.983-90"))
+
+        with freeze_time(datetime.now() - timedelta(days=31)):
+            referral = create_referral()
+        self.assertTrue(referred_cpfs.might_contain(int(referral.target_cpf)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_referrals_older_than_30_days()
+        self.assertFalse(referred_cpfs.might_contain(referral.target_cpf))
+
+    def test_should_rebuild_over_capacity_in_background(self):
+        """
+        Testing if a filter past its capacity keeps answering while it's
+        rebuilt with twice the capacity on a background thread
+        """
+
+        membership = MembershipFilter('test', Client.objects.values_list('cpf', flat=True))
+        with self.settings(MEMBERSHIP_FILTER_CAPACITY=10):
+            membership.build()
+            cpfs = [generate_valid_cpf() for _ in range(11)]
+            membership.add(cpfs)
+            self.assertTrue(all(membership.might_contain(cpf) for cpf in cpfs))
+
+            for thread in threading.enumerate():
+                if thread.name == 'test filter build':
+                    thread.join()
+        self.assertEqual(membership._filter.capacity, 20)
+
+
+class TestImportClients(TestCase):
+    """
+    Test class for unit testing the client import command
+    """
+
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w', encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_should_import_clients_from_csv_and_jsonl(self):
+        """
+        Testing if the command creates the valid clients of CSV and JSON
+        Lines files, in chunks, and lists the rejected lines
+        """
+
+        create_user()
+        cpfs = [generate_valid_cpf() for _ in range(3)]
+        csv_path = self.write_file('.csv', 'cpf,name,phone,email\n' + ''.join(
+            f'{cpf},Cliente {i},31998877554,cliente{i}@gmail.com\n'
+            for i, cpf in enumerate([*cpfs, '11987098390'])))
+        jsonl_path = self.write_file('.jsonl', '\n'.join([
+            json.dumps({'cpf': generate_valid_cpf(), 'name': 'Ana',
+                        'phone': '31998877554', 'email': 'ana@gmail.com'}),
+            '{not json',
+            json.dumps({'cpf': cpfs[0], 'name': 'Ana',
+                        'phone': '31998877554', 'email': 'ana@gmail.com'})]))
+
+        output = StringIO()
+        call_command('import_clients', csv_path, '--batch-size', '2', stdout=output)
+        self.assertIn('line 5: {"cpf": ["client with this CPF  already exists."]}',
+                      output.getvalue())
+        self.assertIn('Imported 3 of 4 clients', output.getvalue())
+
+        output = StringIO()
+        call_command('import_clients', jsonl_path, stdout=output)
+        self.assertIn('line 2: {"non_field_errors"', output.getvalue())
+        self.assertIn('line 3: {"cpf"', output.getvalue())
+        self.assertIn('Imported 1 of 3 clients', output.getvalue())
+        self.assertEqual(Client.objects.count(), 5)
+
+
+class TestIdempotencyStore(TestCase):
+    """
+    Test class for unit testing the stored Idempotency-Key responses
+    """
+
+    def test_should_reserve_key_once_until_it_expires(self):
+        """
+        Testing if a key is reserved by one request only, and can be taken
+        again once it expires
+        """
+
+        key = idempotency_store.key('user', 'retry-1')
+        self.assertTrue(idempotency_store.reserve(key, 'a'))
+        self.assertFalse(idempotency_store.reserve(key, 'a'))
+        self.assertIsNone(idempotency_store.entry(key)['status'])
+
+        with freeze_time((datetime.now() + timedelta(minutes=2)).astimezone().isoformat()):
+            self.assertIsNone(idempotency_store.entry(key))
+            self.assertTrue(idempotency_store.reserve(key, 'b'))
+            self.assertEqual(idempotency_store.entry(key)['fingerprint'], 'b')
+
+
+class TestSQLiteTuning(SimpleTestCase):
+    """
+    Test class for unit testing the SQLite pragmas and the lock retries
+    """
+
+    databases = {'default'}
+
+    def test_should_apply_pragmas_to_connections(self):
+        """
+        Testing if the connections get the pragmas of the settings
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+
+    def test_should_retry_only_lock_errors(self):
+        """
+        Testing if a call that finds the database locked is run again until
+        it succeeds or runs out of attempts, and if other errors aren't
+        retried
+        """
+
+        calls = []
+
+        def locked_twice():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        self.assertEqual(retry_on_lock(locked_twice, attempts=3, backoff=0), 'done')
+        self.assertEqual(len(calls), 3)
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            retry_on_lock(locked_twice, attempts=2, backoff=0)
+        self.assertEqual(len(calls), 2)
+
+        def failing():
+            calls.append(1)
+            raise OperationalError('no such table: referral_client')
+
+        calls.clear()
+        with self.assertRaises(OperationalError):
+            retry_on_lock(failing, attempts=3, backoff=0)
+        self.assertEqual(len(calls), 1)
+
+    def test_should_retry_only_outside_transactions(self):
+        """
+        Testing if a locked call is retried on its own, but runs only once
+        inside an outer transaction, which can't be retried
+        """
+
+        calls = []
+
+        def locked_once():
+            calls.append(1)
+            if len(calls) < 2:
+                raise OperationalError('database is locked')
+            return 'done'
+
+        with self.settings(SQLITE_LOCK_BACKOFF=0):
+            self.assertEqual(retry_outside_transaction(locked_once), 'done')
+            self.assertEqual(len(calls), 2)
+
+            calls.clear()
+            with self.assertRaises(OperationalError), transaction.atomic():
+                retry_outside_transaction(locked_once)
+            self.assertEqual(len(calls), 1)
@@ -4,6 +4,7 @@ valid CPF numbers, a function that creates a valid client in the database,
 and a function to create referrals.
 """
 from ..models import Client, Referral
+from ..utils import update_referral_counters
 
 
 def generate_valid_cpf():
@@ -47,11 +48,14 @@ def create_user():
 
 def create_referral():
     """
-    Creates a referral from our stardard client to a random valid CPF.
+    Creates a referral from our stardard client to a random valid CPF, and
+    counts it like the views do.
     """
 
-    return Referral.objects.create(
-        source_cpf="11987098390",
+    referral = Referral.objects.create(
+        source_cpf_id="11987098390",
         target_cpf=generate_valid_cpf(),
         status=False
-    )
\ No newline at end of file
+    )
+    update_referral_counters(referral.source_cpf_id, total=1, pending=1)
+    return referral
\ No newline at end of file
@@ -1,17 +1,533 @@
-from .models import Referral
+from .cache import client_cache, referral_cache
+from .database import retry_outside_transaction
+from .leaderboard import leaderboard
+from .membership import client_cpfs, referred_cpfs
+from .models import (REFERRAL_POINTS, Client, PointTransaction, Referral,
+                     ReferralArchive, SweepLock)
+from .serializers import NewClientSerializer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Greatest
 from django.utils import timezone
+from datetime import timedelta
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+from collections import Counter
+from itertools import islice
+import os
+import socket
+import threading
+import time
 
 import logging
 logger = logging.getLogger(__name__)
 
-def delete_referrals_older_than_30_days():
+# SQLite before 3.32 allows at most 999 variables per statement, so the
+# chunks (and the IN lists of their ids) stay below it.
+PURGE_BATCH_SIZE = 900
+
+
+def delete_referrals_older_than_30_days(batch_size=PURGE_BATCH_SIZE, on_chunk=None):
     """
     This functions deletes all referral instances that are not accepted yet
-    (status = False) and are older than 30 days
+    (status = False) and are older than 30 days.
+
+    The expired rows are found with a range query on the (status, created_at)
+    index and removed in chunks of `batch_size`, so each DELETE only holds
+    the write lock for a short time. `on_chunk` is called after each chunk,
+    and the purge stops if it returns False. It returns a tuple with the
+    number of deleted referrals and the time the purge took, in seconds.
     """
     logger.info("Checking for expired referrals to delete.")
-    referrals = Referral.objects.filter(status=False)
-    for referral in referrals:
-        tempo = timezone.now() - referral.created_at
-        if tempo.days >= 30:
-            referral.delete()
+    started = time.monotonic()
+    expired = Referral.objects.expired()
+
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(expired.select_for_update()
+                         .values_list('id', 'source_cpf', 'target_cpf')[:batch_size])
+            if not chunk:
+                break
+            count, _ = Referral.objects.filter(
+                id__in=[pk for pk, _, _ in chunk]).delete()
+            discount_expired_referrals(source for _, source, _ in chunk)
+            forget_referred_cpfs(target for _, _, target in chunk)
+        deleted += count
+        if on_chunk is not None and not on_chunk():
+            break
+
+    elapsed = time.monotonic() - started
+    logger.info("Deleted %s expired referrals in %.3f seconds.", deleted, elapsed)
+    return deleted, elapsed
+
+
+def archive_expired_referrals(batch_size=PURGE_BATCH_SIZE, on_chunk=None):
+    """
+    This function moves the expired referrals to the ReferralArchive table,
+    instead of just deleting them.
+
+    Each chunk of `batch_size` referrals is copied with bulk_create and
+    deleted from the Referral table in its own short transaction, so the
+    write lock is never held for long. `on_chunk` is called after each
+    chunk, and the archival stops if it returns False. It returns a tuple
+    with the number of archived referrals and the time the archival took, in
+    seconds.
+    """
+    logger.info("Checking for expired referrals to archive.")
+    started = time.monotonic()
+
+    archived = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(Referral.objects.expired().select_for_update()
+                         .order_by('created_at', 'id')[:batch_size])
+            if not chunk:
+                break
+            ReferralArchive.objects.bulk_create([
+                ReferralArchive(original_id=referral.id,
+                                source_cpf=referral.source_cpf_id,
+                                target_cpf=referral.target_cpf,
+                                created_at=referral.created_at,
+                                updated_at=referral.updated_at,
+                                status=referral.status)
+                for referral in chunk
+            ])
+            Referral.objects.filter(
+                id__in=[referral.id for referral in chunk]).delete()
+            discount_expired_referrals(referral.source_cpf_id for referral in chunk)
+            forget_referred_cpfs(referral.target_cpf for referral in chunk)
+        archived += len(chunk)
+        if on_chunk is not None and not on_chunk():
+            break
+
+    elapsed = time.monotonic() - started
+    logger.info("Archived %s expired referrals in %.3f seconds.", archived, elapsed)
+    return archived, elapsed
+
+
+def update_referral_counters(source_cpf, total=0, pending=0, accepted=0):
+    """
+    Adds the given amounts (which may be negative) to the referral counters
+    of the client `source_cpf`, with a single UPDATE using F() expressions,
+    so concurrent writes never lose an increment. Counters never go below
+    zero; any drift is fixed by `recompute_referral_counters`. The counters
+    change with the referrals of the client, so its cached referral
+    listings are invalidated too.
+    """
+    Client.objects.filter(cpf=source_cpf).update(updated_at=timezone.now(), **{
+        field: Greatest(F(field) + amount, 0)
+        for field, amount in (('referrals_total', total),
+                              ('referrals_pending', pending),
+                              ('referrals_accepted', accepted))
+        if amount
+    })
+    client_cache.invalidate([source_cpf])
+    referral_cache.bump([source_cpf])
+
+
+def set_referral_status(referral, status):
+    """
+    Accepts (status = True) an active referral. An accepted referral was
+    already credited, so it's never reverted: status = False changes nothing.
+
+    The status is flipped with a conditional UPDATE (... WHERE status =
+    false), so when concurrent requests accept the same referral only one
+    of them matches the row. That one moves the referral to the accepted
+    counter of the referrer and credits REFERRAL_POINTS with
+    `points = points + N`, in the same transaction and without reading or
+    rewriting the client row. The credit is also appended to the points
+    ledger, which has at most one credit per referral. It returns True if
+    this call changed the status, and updates `referral` in place.
+    """
+    if not status:
+        return False
+
+    now = timezone.now()
+    with transaction.atomic():
+        changed = Referral.active.filter(pk=referral.pk, status=False).update(
+            status=True, updated_at=now)
+        if changed:
+            credit_accepted_referrals([(referral.pk, referral.source_cpf_id)])
+
+    if changed:
+        referral.status = status
+        referral.updated_at = now
+    return bool(changed)
+
+
+class AcceptConflict(Exception):
+    """
+    Some of the referrals of a bulk accept were changed by another request
+    between reading and updating them.
+    """
+
+
+def accept_referrals(target_cpfs, attempts=3):
+    """
+    Accepts, in one transaction, the active referrals of the given target
+    CPFs. The pending ones are read with one query and flipped with one
+    UPDATE, and each referrer is credited once, with the sum of its
+    referrals. If another request changes one of them in the meantime, the
+    transaction is rolled back and retried, so none is credited twice.
+
+    It returns a dict with the error of each CPF that wasn't accepted.
+    """
+    for _ in range(attempts):
+        try:
+            with transaction.atomic():
+                return _accept_referrals(target_cpfs)
+        except AcceptConflict:
+            logger.warning("Bulk accept conflicted with another request, retrying.")
+    raise AcceptConflict('The referrals kept being changed by other requests.')
+
+
+def _accept_referrals(target_cpfs):
+    referrals = list(Referral.active.filter(target_cpf__in=target_cpfs)
+                     .select_for_update().values_list('id', 'target_cpf', 'source_cpf', 'status'))
+    found = {target_cpf: status for _, target_cpf, _, status in referrals}
+    pending = [(pk, source_cpf) for pk, _, source_cpf, status in referrals if not status]
+
+    if pending:
+        updated = Referral.objects.filter(
+            id__in=[pk for pk, _ in pending], status=False).update(
+            status=True, updated_at=timezone.now())
+        if updated != len(pending):
+            raise AcceptConflict()
+        credit_accepted_referrals(pending)
+
+    errors = {}
+    for target_cpf in target_cpfs:
+        if target_cpf not in found:
+            errors[target_cpf] = 'No active referral registered for this CPF'
+        elif found[target_cpf]:
+            errors[target_cpf] = 'Referral was already accepted'
+    return errors
+
+
+def create_referrals(source_cpf, target_cpfs, status=False, attempts=3):
+    """
+    Creates, in one transaction, the referrals from `source_cpf` to each of
+    the given target CPFs, with the rules of CreateReferralView: the
+    referrer and the targets that are clients are found with one query, the
+    existing referrals of the targets with another (skipped when the
+    membership filter knows none of them was referred), and the new
+    referrals are inserted with bulk_create. Expired referrals of the
+    targets are replaced. Referrals created as accepted (`status`) are
+    credited to the referrer, like accepting them. If another request refers
+    one of the targets in the meantime, the transaction is rolled back and
+    retried, looking the targets up without the filter, which doesn't know
+    the referrals of other processes.
+
+    It returns a dict with the error of each CPF that wasn't referred, and
+    raises Client.DoesNotExist if the referrer isn't registered.
+    """
+    for attempt in range(attempts):
+        try:
+            with transaction.atomic():
+                return _create_referrals(source_cpf, target_cpfs, status,
+                                         use_filter=attempt == 0)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+            logger.warning("Bulk referral conflicted with another request, retrying.")
+
+
+def _create_referrals(source_cpf, target_cpfs, status, use_filter=True):
+    registered = set(Client.objects.filter(
+        cpf__in=[source_cpf, *target_cpfs]).values_list('cpf', flat=True))
+    if source_cpf not in registered:
+        raise Client.DoesNotExist('The referrer is not registered.')
+
+    errors = {}
+    for target_cpf in target_cpfs:
+        if target_cpf == source_cpf:
+            errors[target_cpf] = 'error: User cannot refer themselves'
+        elif target_cpf in registered:
+            errors[target_cpf] = 'error: Referred person is already registered'
+    candidates = [target_cpf for target_cpf in target_cpfs if target_cpf not in errors]
+
+    expired = []
+    if not use_filter or any(referred_cpfs.might_contain(target_cpf)
+                             for target_cpf in candidates):
+        for referral in Referral.objects.filter(target_cpf__in=candidates).only(
+                'source_cpf', 'target_cpf', 'status', 'created_at'):
+            if referral.is_expired:
+                expired.append(referral)
+            else:
+                errors[referral.target_cpf] = 'error: This person was already referred.'
+    if expired:
+        Referral.objects.filter(id__in=[referral.id for referral in expired]).delete()
+        discount_expired_referrals(referral.source_cpf_id for referral in expired)
+        forget_referred_cpfs(referral.target_cpf for referral in expired)
+
+    new_cpfs = [target_cpf for target_cpf in candidates if target_cpf not in errors]
+    if new_cpfs:
+        Referral.objects.bulk_create([
+            Referral(source_cpf_id=source_cpf, target_cpf=target_cpf, status=status)
+            for target_cpf in new_cpfs
+        ], batch_size=PURGE_BATCH_SIZE)
+        update_referral_counters(source_cpf, total=len(new_cpfs), pending=len(new_cpfs))
+        if status:
+            # bulk_create doesn't set the ids on SQLite
+            credit_accepted_referrals([
+                (pk, source_cpf) for pk in Referral.objects.filter(
+                    target_cpf__in=new_cpfs).values_list('id', flat=True)])
+        # bulk_create doesn't send post_save
+        referred_cpfs.add(new_cpfs)
+    return errors
+
+
+def credit_accepted_referrals(referrals):
+    """
+    Credits the referrers of the just accepted referrals, given as (id,
+    source_cpf) tuples: one UPDATE per referrer, with the points of all of its
+    referrals, and one ledger transaction per referral. The cached
+    leaderboard gets the credits once the transaction commits.
+    """
+    credits = {}
+    for source_cpf, count in Counter(source_cpf for _, source_cpf in referrals).items():
+        Client.objects.filter(cpf=source_cpf).update(
+            points=F('points') + REFERRAL_POINTS * count,
+            referrals_pending=Greatest(F('referrals_pending') - count, 0),
+            referrals_accepted=F('referrals_accepted') + count,
+            updated_at=timezone.now())
+        credits[source_cpf] = REFERRAL_POINTS * count
+
+    PointTransaction.objects.bulk_create([
+        PointTransaction(client_id=source_cpf, referral_id=pk, amount=REFERRAL_POINTS,
+                         reason=PointTransaction.REFERRAL_ACCEPTED)
+        for pk, source_cpf in referrals
+    ], batch_size=PURGE_BATCH_SIZE)
+    transaction.on_commit(lambda: leaderboard.record_credits(credits))
+    client_cache.invalidate(credits)
+    referral_cache.bump(credits)
+
+
+def forget_referred_cpfs(target_cpfs):
+    """
+    Removes the targets of deleted referrals from the membership filter,
+    once the transaction commits.
+    """
+    target_cpfs = list(target_cpfs)
+    transaction.on_commit(lambda: referred_cpfs.remove(target_cpfs))
+
+
+def discount_expired_referrals(source_cpfs):
+    """
+    Updates the counters of the referrers of expired referrals that were
+    just removed, with one UPDATE per referrer (not per referral).
+    """
+    for source_cpf, count in Counter(source_cpfs).items():
+        update_referral_counters(source_cpf, total=-count, pending=-count)
+
+
+def recompute_referral_counters():
+    """
+    Recomputes the referral counters of every client from the Referral table,
+    with one GROUP BY query. Returns the number of clients with referrals.
+    """
+    counts = {
+        row['source_cpf']: row for row in Referral.objects.order_by()
+        .values('source_cpf')
+        .annotate(total=Count('id'), accepted=Count('id', filter=Q(status=True)))
+    }
+
+    fields = ['referrals_total', 'referrals_pending', 'referrals_accepted']
+    now = timezone.now()
+    with transaction.atomic():
+        # the clients are scanned in chunks, not looked up by an IN list of
+        # every referrer
+        changed = []
+        for client in Client.objects.only('cpf', *fields).iterator(
+                chunk_size=PURGE_BATCH_SIZE):
+            row = counts.get(client.cpf, {'total': 0, 'accepted': 0})
+            recomputed = (row['total'], row['total'] - row['accepted'], row['accepted'])
+            if recomputed != tuple(getattr(client, field) for field in fields):
+                for field, value in zip(fields, recomputed):
+                    setattr(client, field, value)
+                client.updated_at = now
+                changed.append(client)
+        Client.objects.bulk_update(changed, [*fields, 'updated_at'],
+                                   batch_size=PURGE_BATCH_SIZE)
+        client_cache.invalidate(client.cpf for client in changed)
+    return len(counts)
+
+
+def rebuild_point_balances(dry_run=False):
+    """
+    Reconciles the materialized balances (Client.points) with the points
+    ledger, which is summed with one GROUP BY query. The balances that
+    differ are rewritten, unless `dry_run` is set. Returns a list of
+    (cpf, stored balance, ledger balance) tuples for the mismatched ones.
+    """
+    ledger = dict(PointTransaction.objects.order_by().values('client')
+                  .annotate(balance=Sum('amount')).values_list('client', 'balance'))
+
+    mismatches = []
+    clients = []
+    for client in Client.objects.only('cpf', 'points').iterator(chunk_size=PURGE_BATCH_SIZE):
+        balance = ledger.get(client.cpf, 0)
+        if client.points != balance:
+            mismatches.append((client.cpf, client.points, balance))
+            client.points = balance
+            client.updated_at = timezone.now()
+            clients.append(client)
+
+    if clients and not dry_run:
+        Client.objects.bulk_update(clients, ['points', 'updated_at'],
+                                   batch_size=PURGE_BATCH_SIZE)
+        leaderboard.invalidate()
+        client_cache.invalidate(client.cpf for client in clients)
+    return mismatches
+
+
+def import_clients(rows, batch_size=PURGE_BATCH_SIZE, attempts=3):
+    """
+    Creates clients from an iterable of dicts (with cpf, name, phone and
+    email), `batch_size` rows at a time: the rows are validated by a single
+    serializer, without queries, the CPFs already registered are found with
+    one IN query per chunk, and the new clients are inserted with
+    bulk_create. A row is rejected, without failing the others, if it's
+    invalid or its CPF is registered or repeated.
+
+    Returns the (created, errors, elapsed) tuple of the import, with the
+    errors of each rejected row by its position.
+    """
+    start = time.perf_counter()
+    validator = NewClientSerializer()
+    cpf_field = Client._meta.get_field('cpf')
+    registered_error = {'cpf': [cpf_field.error_messages['unique'] % {
+        'model_name': Client._meta.verbose_name, 'field_label': cpf_field.verbose_name}]}
+    seen = set()
+    created = 0
+    errors = {}
+
+    rows = enumerate(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+
+        clients = {}
+        for index, row in chunk:
+            try:
+                data = validator.run_validation(row)
+            except ValidationError as error:
+                errors[index] = error.detail
+                continue
+            if data['cpf'] in seen:
+                errors[index] = {'cpf': ['CPF repeated on the import.']}
+                continue
+            seen.add(data['cpf'])
+            clients[index] = Client(**data)
+
+        created += _insert_clients(clients, errors, registered_error, attempts)
+        logger.info("Imported %s clients so far.", created)
+
+    return created, errors, time.perf_counter() - start
+
+
+def _insert_clients(clients, errors, registered_error, attempts):
+    """
+    Inserts the clients of a chunk, given by row position, that aren't
+    registered yet. If a CPF is registered by another request between the
+    lookup and the insert, the chunk is looked up and inserted again, and
+    if the database is locked, the insert is retried after a backoff.
+    """
+    for attempt in range(attempts):
+        registered = set(Client.objects.filter(
+            cpf__in=[client.cpf for client in clients.values()]).values_list('cpf', flat=True))
+        for index in [index for index, client in clients.items() if client.cpf in registered]:
+            errors[index] = registered_error
+            del clients[index]
+
+        def insert():
+            with transaction.atomic():
+                Client.objects.bulk_create(clients.values(), batch_size=PURGE_BATCH_SIZE)
+        try:
+            retry_outside_transaction(insert)
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
+            continue
+        # bulk_create doesn't send post_save
+        client_cpfs.add(client.cpf for client in clients.values())
+        return len(clients)
+
+
+def acquire_lock(name, owner, ttl):
+    """
+    Tries to take the database lock `name` for `owner` during `ttl` seconds.
+    The lock is taken with a single conditional UPDATE, so only one worker
+    (on any node sharing the database) gets it. Returns True on success.
+    """
+    now = timezone.now()
+    SweepLock.objects.get_or_create(
+        name=name, defaults={'owner': '', 'locked_until': now})
+    taken = SweepLock.objects.filter(name=name).filter(
+        Q(locked_until__lte=now) | Q(owner=owner)
+    ).update(owner=owner, locked_until=now + timedelta(seconds=ttl))
+    return taken == 1
+
+
+def release_lock(name, owner):
+    """
+    Releases the database lock `name`, if it is still held by `owner`.
+    """
+    SweepLock.objects.filter(name=name, owner=owner).update(
+        owner='', locked_until=timezone.now())
+
+
+def sweep_expired_referrals(batch_size=PURGE_BATCH_SIZE, archive=True):
+    """
+    Archives (or just deletes, if `archive` is False) the expired referrals
+    under the 'expire_referrals' database lock, which is extended after
+    each chunk, so a long sweep never outlives it. Returns the (count,
+    elapsed) tuple of the sweep, or None if another worker is already
+    sweeping.
+    """
+    owner = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    ttl = getattr(settings, 'REFERRAL_SWEEP_LOCK_TTL', 300)
+
+    if not acquire_lock('expire_referrals', owner, ttl):
+        logger.info("Another worker is sweeping expired referrals, skipping.")
+        return None
+
+    def extend_lock():
+        if acquire_lock('expire_referrals', owner, ttl):
+            return True
+        logger.warning("Lost the expired referrals sweep lock, stopping.")
+        return False
+
+    try:
+        if archive:
+            return archive_expired_referrals(batch_size=batch_size, on_chunk=extend_lock)
+        return delete_referrals_older_than_30_days(batch_size=batch_size, on_chunk=extend_lock)
+    finally:
+        release_lock('expire_referrals', owner)
+
+
+def stream_json(queryset, serializer, json_lines=False, chunk_size=2000):
+    """
+    Generator that serializes the queryset one row at a time with the given
+    serializer instance, reading it from the database in chunks of
+    `chunk_size`, and yields it as a JSON array (or as JSON Lines, one object
+    per line). Used for streaming responses, so the memory used does not
+    depend on the number of rows.
+    """
+    encoder = JSONEncoder(ensure_ascii=False)
+    rows = queryset.iterator(chunk_size=chunk_size)
+
+    if json_lines:
+        for row in rows:
+            yield encoder.encode(serializer.to_representation(row)) + '\n'
+        return
+
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + encoder.encode(serializer.to_representation(row))
+        separator = ','
+    yield ']'
@@ -6,14 +6,35 @@ of how the API deals with invalid or bad requests, please refer to the
 Postman documentation, linked in the repository README.md file.
 """
 
+from collections.abc import Mapping
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils.dateparse import parse_datetime
 from rest_framework import status, generics
 from rest_framework.response import Response
-
+from localflavor.br.validators import BRCPFValidator
+
+from .cache import client_cache, referral_cache
+from .conditional import add_validators, is_conditional, not_modified
+from .database import retry_when_locked
+from .fields import normalize_cpf
+from .filters import filter_referrals
+from .idempotency import idempotent
+from .leaderboard import client_rank, leaderboard
+from .membership import client_cpfs, referred_cpfs
 from .models import Client, Referral
-from .serializers import ClientSerializer, ReferralSerializer
-from .utils import delete_referrals_older_than_30_days
+from .pagination import KeysetPagination
+from .serializers import (BulkAcceptSerializer, BulkClientSerializer, BulkReferralSerializer,
+                          ClientSerializer, FastReadSerializer, NewClientSerializer,
+                          ReferralSerializer, ReferralWriteSerializer, requested_fields)
+from .utils import (AcceptConflict, accept_referrals, create_referrals,
+                    credit_accepted_referrals, discount_expired_referrals, forget_referred_cpfs, import_clients,
+                    set_referral_status, stream_json, update_referral_counters)
 
 import logging
 logger = logging.getLogger(__name__)
@@ -30,11 +51,17 @@ class MainPage(generics.ListAPIView):
 
     def get(self, request):
         urls = {'User detail and update': 'user/<str:cpf>/',
+                'Create many users at once': 'users/',
                 'List of all referrals registered': 'all-referrals/',
                 'List of all referrals performed by an user registered': 'all-referrals/<str:cpf>/',
                 'Information on specific referral': 'referral/<str:cpf>/',
                 'Create new referral': 'create-referral/',
+                'Create many referrals at once': 'create-referrals/',
                 'Accept specific referral': 'accept-referral/<str:cpf>/',
+                'Accept many referrals at once': 'accept-referrals/',
+                'Clients with the most points': 'leaderboard/',
+                'Position of an user on the leaderboard': 'leaderboard/<str:cpf>/',
+                'Cache hit and miss counters': 'cache-stats/',
                 }
         logger.info("Received request to get the main page.")
         return Response(urls, status=status.HTTP_200_OK)
@@ -64,6 +91,8 @@ class CreateUserView(generics.ListCreateAPIView):
         logger.info("Waiting for user to create new client.")
         return Response(["waiting on client creation"], status=status.HTTP_200_OK)
 
+    @idempotent('user')
+    @retry_when_locked
     def post(self, request):
         """
         Creates a new user
@@ -77,6 +106,8 @@ class CreateUserView(generics.ListCreateAPIView):
                 "phone": "11956555877",
                 "email": "jose.coelho@gmail.com"
             }
+            - Optionally, an 'Idempotency-Key' header, so a retry with the
+              same key gets the first response back without creating anything;
 
         It returns:
              - HTTP status = 201;
@@ -97,11 +128,26 @@ class CreateUserView(generics.ListCreateAPIView):
         request_data = request.data
         logger.info(
             "Received a request to create a new client with the following data: %s:", request_data)
-        serializer = self.serializer_class(data=request.data)
+        serializer_class = self.serializer_class
+        # a body that isn't an object is left for the serializer to reject
+        if isinstance(request_data, Mapping) and not client_cpfs.might_contain(
+                request_data.get('cpf', '')):
+            # the CPF is surely new, so its unique check can be left to the insert
+            serializer_class = NewClientSerializer
+        serializer = serializer_class(data=request.data)
 
         if serializer.is_valid():
             if request.data['cpf'].isalnum():
-                serializer.save()
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                except IntegrityError:
+                    logger.info(
+                        "CPF was registered by another process, validating it again.")
+                    serializer = self.serializer_class(data=request.data)
+                    if not serializer.is_valid():
+                        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                    serializer.save()
                 logger.info(
                     "Requested data is valid, created the user and returning 201!")
                 return Response({'Created user:': serializer.data}, status=status.HTTP_201_CREATED)
@@ -114,6 +160,70 @@ class CreateUserView(generics.ListCreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BulkCreateUsersView(generics.GenericAPIView):
+    """
+    Creates many clients at once.
+    """
+
+    serializer_class = BulkClientSerializer
+
+    # not retried as a whole: each chunk is committed and retried on its own
+    def post(self, request):
+        """
+        Creates the given clients: they are validated together, the CPFs
+        already registered are found with one query and the new clients are
+        inserted in bulk. An invalid client doesn't fail the others.
+
+        It expects:
+        - POST as http method;
+        - A JSON like this (with at most CLIENT_BULK_MAX_ITEMS clients):
+            {
+                "clients": [
+                    {"cpf": "94353687433", "name": "José Coelho",
+                     "phone": "11956555877", "email": "jose.coelho@gmail.com"},
+                    {"cpf": "123", "name": "Ana Lima",
+                     "phone": "11956555878", "email": "ana.lima@gmail.com"}
+                ]
+            }
+
+        It returns:
+        - HTTP status = 200;
+        - A JSON with the result of each client, like this:
+            {
+                "created": 1,
+                "rows_per_second": 4210.5,
+                "results": [
+                    {"cpf": "94353687433", "created": true},
+                    {"cpf": "123", "created": false,
+                     "errors": {"cpf": ["Invalid CPF number."]}}
+                ]
+            }
+        """
+
+        logger.info("Received a request to create clients in bulk.")
+        serializer = self.serializer_class(data=request.data)
+
+        if not serializer.is_valid():
+            logger.warning("Requested data is invalid, returning 400.")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        clients = serializer.validated_data['clients']
+        created, errors, elapsed = import_clients(clients)
+
+        results = []
+        for index, client in enumerate(clients):
+            cpf = client.get('cpf') if isinstance(client, dict) else None
+            if index in errors:
+                results.append({'cpf': cpf, 'created': False, 'errors': errors[index]})
+            else:
+                results.append({'cpf': cpf, 'created': True})
+
+        logger.info("Created %s of %s clients, returning 200.", created, len(clients))
+        return Response({'created': created,
+                         'rows_per_second': round(len(clients) / elapsed, 1) if elapsed else None,
+                         'results': results}, status=status.HTTP_200_OK)
+
+
 class UpdateUserView(generics.RetrieveUpdateAPIView):
     """
     Gets and/or change the data of a specific user.
@@ -130,6 +240,8 @@ class UpdateUserView(generics.RetrieveUpdateAPIView):
         It expects:
         - GET as http method;
         - The CPF specified on the url;
+        - Optionally, the 'fields' query parameter, like '?fields=name,points',
+          to return only some of the fields;
 
         It returns:
         - HTTP status = 200;
@@ -146,11 +258,40 @@ class UpdateUserView(generics.RetrieveUpdateAPIView):
         """
 
         logger.info("Received a request to fetch a specific User")
-
-        user = get_object_or_404(Client, cpf=cpf)
-        serializer = ClientSerializer(user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
-
+        fields = requested_fields(request, ClientSerializer)
+        variant = ','.join(fields or ())
+
+        # the whole client is cached, the requested fields are picked from it
+        key = client_cache.key(cpf)
+        user = client_cache.get(key)
+        cache_status = 'HIT'
+        if user is None:
+            if is_conditional(request):
+                updated_at = Client.objects.filter(cpf=cpf).values_list(
+                    'updated_at', flat=True).first()
+                response = not_modified(request, updated_at, variant)
+                if response is not None:
+                    logger.info("User didn't change, returning 304.")
+                    return response
+
+            serializer = FastReadSerializer(ClientSerializer)
+            user = serializer.to_representation(
+                get_object_or_404(serializer.rows(Client.objects), cpf=cpf))
+            client_cache.set(key, user)
+            cache_status = 'MISS'
+
+        updated_at = parse_datetime(user['updated_at'])
+        response = not_modified(request, updated_at, variant)
+        if response is not None:
+            logger.info("User didn't change, returning 304.")
+            return response
+
+        if fields:
+            user = {name: value for name, value in user.items() if name in fields}
+        response = Response(user, status=status.HTTP_200_OK, headers={'X-Cache': cache_status})
+        return add_validators(response, updated_at, variant)
+
+    @retry_when_locked
     def put(self, request, cpf):
         """
         Saves the changes made for the requested user
@@ -206,33 +347,71 @@ class UpdateUserView(generics.RetrieveUpdateAPIView):
 
 class GetReferralsView(generics.ListAPIView):
     """
-    Gets the data of all referrals on database.
+    Gets the data of all referrals on database, one page at a time.
     """
     """
     It expects:
     - GET as http method;
+    - Optionally, the 'page_size' and 'cursor' query parameters;
+    - Optionally, 'stream=1' (JSON array) or 'stream=jsonl' (JSON Lines) to
+      export all referrals in a single streamed response, without pagination;
+    - Optionally, the 'fields' query parameter, like '?fields=target_cpf,status',
+      to return only some of the fields;
+    - Optionally, the filters 'status' (true or false), 'created_after' and
+      'created_before', 'updated_since' (dates or datetimes) and 'source_cpf';
     
     It returns:
     - HTTP status = 200;
     - A JSON like this:
-        [
-            {
-                "id": 1,
-                "source_cpf": "12631049675",
-                "target_cpf": "51805510649",
-                "created_at": "2021-12-21T15:22:23.097487-03:00",
-                "updated_at": "2021-12-23T15:04:34.881831-03:00",
-                "status": true
-            },
-            ...
-        ]
+        {
+            "next": "http://127.0.0.1:8000/all-referrals/?cursor=MjAy...",
+            "results": [
+                {
+                    "id": 1,
+                    "source_cpf": "12631049675",
+                    "target_cpf": "51805510649",
+                    "created_at": "2021-12-21T15:22:23.097487-03:00",
+                    "updated_at": "2021-12-23T15:04:34.881831-03:00",
+                    "status": true
+                },
+                ...
+            ]
+        }
     """
 
-    logger.info("Received a request to fetch a list of all Referrals")
-
-    delete_referrals_older_than_30_days()
-    queryset = Referral.objects.all()
     serializer_class = ReferralSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return filter_referrals(Referral.active.all(), self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        serializer = FastReadSerializer(
+            ReferralSerializer, requested_fields(request, ReferralSerializer))
+        stream = request.query_params.get('stream')
+        if not stream:
+            logger.info("Received a request to fetch a list of all Referrals")
+            key = referral_cache.key(
+                'all-referrals', referral_cache.ALL, request.build_absolute_uri())
+            page = referral_cache.get(key)
+            if page is not None:
+                return Response(page, status=status.HTTP_200_OK, headers={'X-Cache': 'HIT'})
+
+            referrals = self.paginate_queryset(
+                serializer.rows(self.get_queryset(), 'created_at', 'id'))
+            response = self.get_paginated_response(serializer.serialize(referrals))
+            referral_cache.set(key, response.data)
+            response['X-Cache'] = 'MISS'
+            return response
+
+        logger.info("Received a request to export all Referrals.")
+        json_lines = stream == 'jsonl'
+        rows = stream_json(
+            serializer.rows(self.get_queryset().order_by('created_at', 'id')),
+            serializer, json_lines=json_lines,
+            chunk_size=getattr(settings, 'REFERRAL_STREAM_CHUNK_SIZE', 2000))
+        content_type = 'application/x-ndjson' if json_lines else 'application/json'
+        return StreamingHttpResponse(rows, content_type=content_type)
 
 
 class GetUserReferralsView(generics.RetrieveAPIView):
@@ -242,45 +421,62 @@ class GetUserReferralsView(generics.RetrieveAPIView):
 
     queryset = Referral.objects.all()
     serializer_class = ReferralSerializer
+    pagination_class = KeysetPagination
     lookup_field = 'source_cpf'
 
     def get(self, request, cpf):
         """
-        Returns a list of referrals performed by specific user.
+        Returns a page of the referrals performed by specific user.
 
         It expects:
         - GET as http method;
         - The CPF specified on the url;
+        - Optionally, the 'page_size' and 'cursor' query parameters;
+        - Optionally, the 'fields' query parameter, to return only some of
+          the fields;
 
         It returns:
         - HTTP status = 200;
         - A JSON like this:
-            [
             {
-                "id": 3,
-                "source_cpf": "52768135070",
-                "target_cpf": "58874265786",
-                "created_at": "2021-12-21T18:50:30.355478-03:00",
-                "updated_at": "2021-12-21T18:50:30.355534-03:00",
-                "status": false
-            },
-            ...
-        ]
+                "next": "http://127.0.0.1:8000/all-referrals/52768135070/?cursor=MjAy...",
+                "results": [
+                    {
+                        "id": 3,
+                        "source_cpf": "52768135070",
+                        "target_cpf": "58874265786",
+                        "created_at": "2021-12-21T18:50:30.355478-03:00",
+                        "updated_at": "2021-12-21T18:50:30.355534-03:00",
+                        "status": false
+                    },
+                    ...
+                ]
+            }
         """
 
         logger.info(
             "Received a request to fetch a list of all Referrals made by user: %s", cpf)
 
-        delete_referrals_older_than_30_days()
+        key = referral_cache.key(
+            'user-referrals', referral_cache.scope(cpf), request.build_absolute_uri())
+        page = referral_cache.get(key)
+        if page is not None:
+            logger.info("Returning cached referrals and 200!")
+            return Response(page, status=status.HTTP_200_OK, headers={'X-Cache': 'HIT'})
+
         is_client_on_db = Client.objects.filter(cpf=cpf).exists()
 
         if is_client_on_db:
-            if Referral.objects.filter(source_cpf=cpf).exists():
-                referrals = Referral.objects.filter(source_cpf=cpf)
-                serializer = ReferralSerializer(referrals, many=True)
-
+            serializer = FastReadSerializer(
+                ReferralSerializer, requested_fields(request, ReferralSerializer))
+            referrals = self.paginate_queryset(serializer.rows(
+                Referral.active.filter(source_cpf=cpf), 'created_at', 'id'))
+            if referrals or self.paginator.cursor_query_param in request.query_params:
                 logger.info("Data checks, returning referrals and 200!")
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                response = self.get_paginated_response(serializer.serialize(referrals))
+                referral_cache.set(key, response.data)
+                response['X-Cache'] = 'MISS'
+                return response
             else:
 
                 logger.warning("User doesn't have referrals, returning 404.")
@@ -306,6 +502,8 @@ class GetReferralView(generics.RetrieveAPIView):
         It expects:
         - GET as http method;
         - The CPF specified on the url;
+        - Optionally, the 'fields' query parameter, to return only some of
+          the fields;
 
         It returns:
         - HTTP status = 200;
@@ -321,13 +519,39 @@ class GetReferralView(generics.RetrieveAPIView):
         """
 
         logger.info("Received a request to fetch a specific Referral")
-        delete_referrals_older_than_30_days()
-        if Referral.objects.filter(target_cpf=cpf).exists():
-            referrals = Referral.objects.filter(target_cpf=cpf)
-            serializer = ReferralSerializer(referrals, many=True)
-
+        fields = requested_fields(request, ReferralSerializer)
+        variant = ','.join(fields or ())
+        queryset = Referral.active.filter(target_cpf=cpf)
+
+        key = referral_cache.key('referral', referral_cache.ALL, request.build_absolute_uri())
+        cached = referral_cache.get(key)
+        if cached is not None:
+            response = not_modified(request, cached['updated_at'], variant)
+            if response is not None:
+                logger.info("Referral didn't change, returning 304.")
+                return response
+            logger.info("Returning cached referral and 200!")
+            response = Response(cached['referrals'], status=status.HTTP_200_OK,
+                                headers={'X-Cache': 'HIT'})
+            return add_validators(response, cached['updated_at'], variant)
+
+        if is_conditional(request):
+            updated_at = queryset.aggregate(latest=Max('updated_at'))['latest']
+            response = not_modified(request, updated_at, variant)
+            if response is not None:
+                logger.info("Referral didn't change, returning 304.")
+                return response
+
+        serializer = FastReadSerializer(ReferralSerializer, fields)
+        rows = list(serializer.rows(queryset, 'updated_at'))
+        referrals = serializer.serialize(rows)
+
+        if referrals:
             logger.info("Data checks, returning referral and 200!")
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            updated_at = max(row.updated_at for row in rows)
+            referral_cache.set(key, {'referrals': referrals, 'updated_at': updated_at})
+            response = Response(referrals, status=status.HTTP_200_OK, headers={'X-Cache': 'MISS'})
+            return add_validators(response, updated_at, variant)
         else:
             logger.warning(
                 "This person doesn't have active referrals, returning 404.")
@@ -340,7 +564,7 @@ class CreateReferralView(generics.ListCreateAPIView):
     """
 
     queryset = Referral.objects.all()
-    serializer_class = ReferralSerializer
+    serializer_class = ReferralWriteSerializer
 
     def get(self, request):
         """
@@ -358,6 +582,8 @@ class CreateReferralView(generics.ListCreateAPIView):
         logger.info("Waiting for user to create a referral.")
         return Response(["waiting on referral creation"], status=status.HTTP_200_OK)
 
+    @idempotent('create-referral')
+    @retry_when_locked
     def post(self, request):
         """
         Creates a referral.
@@ -370,6 +596,8 @@ class CreateReferralView(generics.ListCreateAPIView):
             "target_cpf": "12262411239",
             "status": false
         }
+        - Optionally, an 'Idempotency-Key' header, so a retry with the same
+          key gets the first response back without creating anything;
 
         It returns:
         - HTTP status = 201;
@@ -389,19 +617,30 @@ class CreateReferralView(generics.ListCreateAPIView):
         request_data = request.data
         logger.info(
             "Received a request to create a referral with the following data: %s:", request_data)
-        delete_referrals_older_than_30_days()
         serializer = self.serializer_class(data=request.data)
 
         if serializer.is_valid():
-            if Client.objects.filter(cpf=request.data['source_cpf']).exists():
-                if request.data['source_cpf'] == request.data['target_cpf']:
+            source_cpf = serializer.validated_data['source_cpf_id']
+            target_cpf = serializer.validated_data['target_cpf']
+
+            # a target the membership filter never saw can't have a referral
+            if referred_cpfs.might_contain(target_cpf):
+                already_referred = self.check_existing_referral(target_cpf)
+                if already_referred is not None:
+                    return already_referred
+
+            registered = set(Client.objects.filter(
+                cpf__in=[source_cpf, target_cpf]).values_list('cpf', flat=True))
+
+            if source_cpf in registered:
+                if source_cpf == target_cpf:
 
                     logger.warning(
                         "User is trying to refer themselves, returning 400.")
                     return Response(["error: User cannot refer themselves"], status=status.HTTP_400_BAD_REQUEST)
 
                 else:
-                    if Client.objects.filter(cpf=request.data['target_cpf']).exists():
+                    if target_cpf in registered:
 
                         logger.warning(
                             "User is trying to refer someone who is already on database, returning 400.")
@@ -409,7 +648,15 @@ class CreateReferralView(generics.ListCreateAPIView):
                                         status=status.HTTP_400_BAD_REQUEST)
 
                     else:
-                        serializer.save()
+                        try:
+                            self.save_referral(serializer, source_cpf)
+                        except IntegrityError:
+                            logger.info(
+                                "Target was referred by another process, checking it again.")
+                            already_referred = self.check_existing_referral(target_cpf)
+                            if already_referred is not None:
+                                return already_referred
+                            self.save_referral(serializer, source_cpf)
 
                         logger.info(
                             "Data checks, creating referral and returning 201!")
@@ -420,7 +667,9 @@ class CreateReferralView(generics.ListCreateAPIView):
                     "Non-registered user is trying to refer someone, returning 400.")
                 return Response(["error: User must be registered to make a referral"], status=status.HTTP_404_NOT_FOUND)
 
-        elif Referral.objects.filter(target_cpf=request.data['target_cpf']).exists():
+        # the target CPF itself passed the validation
+        elif 'target_cpf' not in serializer.errors and Referral.active.filter(
+                target_cpf=normalize_cpf(request.data['target_cpf'])).exists():
             logger.warning(
                 "User is trying to refer someone with an active referral, returning 400.")
             return Response("error: This person was already referred.",
@@ -430,6 +679,125 @@ class CreateReferralView(generics.ListCreateAPIView):
             logger.warning("Requested data is invalid, returnin 400")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def check_existing_referral(target_cpf):
+        """
+        Returns a 400 response if the target has an active referral. An
+        expired referral that wasn't swept yet is deleted, so it doesn't
+        block a new one.
+        """
+        referral = Referral.objects.filter(target_cpf=target_cpf).only(
+            'source_cpf', 'target_cpf', 'status', 'created_at').first()
+        if referral is None:
+            return None
+        if not referral.is_expired:
+            logger.warning(
+                "User is trying to refer someone with an active referral, returning 400.")
+            return Response("error: This person was already referred.",
+                            status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            referral.delete()
+            discount_expired_referrals([referral.source_cpf_id])
+            forget_referred_cpfs([referral.target_cpf])
+        return None
+
+    @staticmethod
+    def save_referral(serializer, source_cpf):
+        with transaction.atomic():
+            referral = serializer.save()
+            update_referral_counters(source_cpf, total=1, pending=1)
+            # a referral created as accepted is credited like an accepted one
+            if referral.status:
+                credit_accepted_referrals([(referral.pk, source_cpf)])
+
+
+class BulkCreateReferralsView(generics.GenericAPIView):
+    """
+    Creates many referrals of one user at once.
+    """
+
+    serializer_class = BulkReferralSerializer
+
+    @retry_when_locked
+    def post(self, request):
+        """
+        Creates the referrals from the given user to each of the given CPFs,
+        in one transaction, with the same rules as 'create-referral/'.
+
+        It expects:
+        - POST as http method;
+        - A JSON like this (with at most REFERRAL_BULK_MAX_ITEMS CPFs):
+            {
+                "source_cpf": "11987098390",
+                "target_cpfs": ["10370335317", "12262411239", "123"],
+                "status": false
+            }
+
+        It returns:
+        - HTTP status = 200;
+        - A JSON with the result of each CPF, like this:
+            {
+                "created": 1,
+                "results": [
+                    {"target_cpf": "10370335317", "created": true},
+                    {"target_cpf": "12262411239", "created": false,
+                     "error": "error: This person was already referred."},
+                    {"target_cpf": "123", "created": false,
+                     "error": "Invalid CPF number."}
+                ]
+            }
+        """
+
+        logger.info("Received a request to create referrals in bulk.")
+        serializer = self.serializer_class(data=request.data)
+
+        if not serializer.is_valid():
+            logger.warning("Requested data is invalid, returning 400.")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        source_cpf = serializer.validated_data['source_cpf']
+        target_cpfs = serializer.validated_data['target_cpfs']
+        # the errors found without the database, one per item
+        item_errors = []
+        valid_cpfs = []
+        validate_cpf = BRCPFValidator()
+        for target_cpf in target_cpfs:
+            try:
+                validate_cpf(target_cpf)
+            except ValidationError as error:
+                item_errors.append(error.messages[0])
+                continue
+            if target_cpf in valid_cpfs:
+                item_errors.append('CPF repeated on the request')
+                continue
+            item_errors.append(None)
+            valid_cpfs.append(target_cpf)
+
+        try:
+            errors = create_referrals(source_cpf, valid_cpfs,
+                                      status=serializer.validated_data['status'])
+        except Client.DoesNotExist:
+            logger.warning(
+                "Non-registered user is trying to refer someone, returning 404.")
+            return Response(["error: User must be registered to make a referral"],
+                            status=status.HTTP_404_NOT_FOUND)
+        except IntegrityError:
+            logger.warning("Targets kept being referred by other requests, returning 409.")
+            return Response({"error": "The targets are being referred by other requests, try again."},
+                            status=status.HTTP_409_CONFLICT)
+
+        results = []
+        for target_cpf, error in zip(target_cpfs, item_errors):
+            error = error or errors.get(target_cpf)
+            if error:
+                results.append({'target_cpf': target_cpf, 'created': False, 'error': error})
+            else:
+                results.append({'target_cpf': target_cpf, 'created': True})
+        created = sum(result['created'] for result in results)
+
+        logger.info("Created %s of %s referrals, returning 200.", created, len(target_cpfs))
+        return Response({'created': created, 'results': results}, status=status.HTTP_200_OK)
+
 
 class AcceptReferralView(generics.RetrieveUpdateAPIView):
     """
@@ -448,6 +816,8 @@ class AcceptReferralView(generics.RetrieveUpdateAPIView):
         It expects:
         - GET as http method;
         - The CPF specified on the url;
+        - Optionally, the 'fields' query parameter, to return only some of
+          the fields;
 
         It returns:
         - HTTP status = 200;
@@ -463,16 +833,18 @@ class AcceptReferralView(generics.RetrieveUpdateAPIView):
         """
 
         logger.info("Received a request to fetch a specific Referral")
-        delete_referrals_older_than_30_days()
-        if Referral.objects.filter(target_cpf=cpf).exists():
-            referrals = Referral.objects.get(target_cpf=cpf)
-            serializer = ReferralSerializer(referrals)
+        serializer = FastReadSerializer(
+            ReferralSerializer, requested_fields(request, ReferralSerializer))
+        referral = serializer.rows(Referral.active.filter(target_cpf=cpf)).first()
+
+        if referral is not None:
             logger.info("Data checks, returning referral and 200!")
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return Response(serializer.to_representation(referral), status=status.HTTP_200_OK)
         else:
             logger.warning("No referrals with this CPF, returning 404")
             return Response({"error": "No active referral registered for this CPF"}, status=status.HTTP_404_NOT_FOUND)
 
+    @retry_when_locked
     def put(self, request, cpf):
         """
         Updates the specified referral.
@@ -508,32 +880,30 @@ class AcceptReferralView(generics.RetrieveUpdateAPIView):
         logger.info(
             "Received a request to update a specific User, with the following data: %s", request_data)
 
-        referral = Referral.objects.get(target_cpf=cpf)
-        serializer = ReferralSerializer(
+        referral = get_object_or_404(Referral.active, target_cpf=cpf)
+        serializer = ReferralWriteSerializer(
             referral, data=request.data, partial=True)
-        referrent = Client.objects.get(cpf=referral.source_cpf)
-        updated_status = request.data['status']
 
         if serializer.is_valid():
-            if request.data['target_cpf'] == cpf and request.data['source_cpf'] == referral.source_cpf:
-                if updated_status:
-                    with transaction.atomic():
-                        """
-                        Using atomic to ensure both actions will happen, or neither of them.
-                        The number of points can be changed to be consistent with the existing point system
-                        """
-                        referrent.points += 10
-                        referrent.save()
-                        serializer.save()
+            if request.data['target_cpf'] == cpf and request.data['source_cpf'] == referral.source_cpf_id:
+                updated_status = serializer.validated_data.get('status', referral.status)
+                if referral.status and not updated_status:
+                    logger.warning(
+                        "User is trying to revert an accepted referral, returning 400.")
+                    return Response({"error": "An accepted referral cannot be reverted"},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+                # the status is flipped with a conditional UPDATE, so a referral
+                # is credited only once, even with concurrent requests
+                changed = set_referral_status(referral, updated_status)
+                data = ReferralSerializer(referral).data
 
+                if changed:
                     logger.info(
                         "User accepted the referral! Giving points to referrer and returning 200!")
-                    return Response({'Updated referral:': serializer.data}, status=status.HTTP_200_OK)
-
                 else:
-                    serializer.save()
-                    logger.info("User didn't accept referral, returning 200.")
-                    return Response({'Updated referral:': serializer.data}, status=status.HTTP_200_OK)
+                    logger.info("Referral status didn't change, returning 200.")
+                return Response({'Updated referral:': data}, status=status.HTTP_200_OK)
 
             else:
                 logger.warning("User is trying to change CPFs, returning 400.")
@@ -541,3 +911,176 @@ class AcceptReferralView(generics.RetrieveUpdateAPIView):
 
         logger.warning("Requested data is invalid, returning 400.")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BulkAcceptReferralsView(generics.GenericAPIView):
+    """
+    Accepts many referrals at once.
+    """
+
+    serializer_class = BulkAcceptSerializer
+
+    @retry_when_locked
+    def post(self, request):
+        """
+        Accepts the referrals of the given CPFs of referred people, in one
+        transaction: their statuses are flipped with one UPDATE, and each
+        referrer is credited once, with the points of all its referrals.
+
+        It expects:
+        - POST as http method;
+        - A JSON like this (with at most REFERRAL_BULK_MAX_ITEMS CPFs):
+            {
+                "target_cpfs": ["10370335317", "12262411239", "123"]
+            }
+
+        It returns:
+        - HTTP status = 200;
+        - A JSON with the result of each CPF, like this:
+            {
+                "accepted": 1,
+                "results": [
+                    {"target_cpf": "10370335317", "accepted": true},
+                    {"target_cpf": "12262411239", "accepted": false,
+                     "error": "Referral was already accepted"},
+                    {"target_cpf": "123", "accepted": false,
+                     "error": "Invalid CPF number."}
+                ]
+            }
+        """
+
+        logger.info("Received a request to accept referrals in bulk.")
+        serializer = self.serializer_class(data=request.data)
+
+        if not serializer.is_valid():
+            logger.warning("Requested data is invalid, returning 400.")
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        target_cpfs = serializer.validated_data['target_cpfs']
+        # the errors found without the database, one per item
+        item_errors = []
+        valid_cpfs = set()
+        validate_cpf = BRCPFValidator()
+        for target_cpf in target_cpfs:
+            try:
+                validate_cpf(target_cpf)
+            except ValidationError as error:
+                item_errors.append(error.messages[0])
+                continue
+            if target_cpf in valid_cpfs:
+                item_errors.append('CPF repeated on the request')
+                continue
+            item_errors.append(None)
+            valid_cpfs.add(target_cpf)
+
+        try:
+            errors = accept_referrals(sorted(valid_cpfs))
+        except AcceptConflict:
+            logger.warning("Referrals kept being changed by other requests, returning 409.")
+            return Response({"error": "The referrals are being changed by other requests, try again."},
+                            status=status.HTTP_409_CONFLICT)
+
+        results = []
+        for target_cpf, error in zip(target_cpfs, item_errors):
+            error = error or errors.get(target_cpf)
+            if error:
+                results.append({'target_cpf': target_cpf, 'accepted': False, 'error': error})
+            else:
+                results.append({'target_cpf': target_cpf, 'accepted': True})
+        accepted = sum(result['accepted'] for result in results)
+
+        logger.info("Accepted %s of %s referrals, returning 200.", accepted, len(target_cpfs))
+        return Response({'accepted': accepted, 'results': results}, status=status.HTTP_200_OK)
+
+
+class LeaderboardView(generics.GenericAPIView):
+    """
+    Gets the clients with the most points.
+    """
+
+    default_limit = 10
+
+    def get(self, request):
+        """
+        Gets the top clients, by points. It is served from an in-process
+        cache, so it can be polled without hitting the database.
+
+        It expects:
+        - GET as http method;
+        - Optionally, the 'limit' query parameter, with the number of clients
+          (10 by default, up to LEADERBOARD_SIZE);
+
+        It returns:
+        - HTTP status = 200;
+        - A JSON like this:
+            [
+                {"rank": 1, "cpf": "12631049675", "name": "Ana", "points": 30},
+                {"rank": 2, "cpf": "11987098390", "name": "Luisa Souza", "points": 10}
+            ]
+        """
+
+        logger.info("Received a request to fetch the leaderboard.")
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = self.default_limit
+        limit = min(limit, settings.LEADERBOARD_SIZE) if limit > 0 else self.default_limit
+
+        return Response(leaderboard.top(limit), status=status.HTTP_200_OK)
+
+
+class ClientRankView(generics.GenericAPIView):
+    """
+    Gets the position of a client on the leaderboard.
+    """
+
+    def get(self, request, cpf):
+        """
+        Gets the rank of the user whose CPF is passed on the URL path.
+
+        It expects:
+        - GET as http method;
+        - The CPF specified on the url;
+
+        It returns:
+        - HTTP status = 200;
+        - A JSON like this:
+            {
+                "cpf": "11987098390",
+                "rank": 2,
+                "points": 10
+            }
+        """
+
+        logger.info("Received a request to fetch the rank of a specific User.")
+        rank = client_rank(cpf)
+
+        if rank is None:
+            logger.warning("User is not registered, returning 404.")
+            return Response(["error: User not on database"], status=status.HTTP_404_NOT_FOUND)
+
+        return Response({'cpf': cpf, **rank}, status=status.HTTP_200_OK)
+
+
+class CacheStatsView(generics.GenericAPIView):
+    """
+    Gets the hit and miss counters of the caches of this process.
+    """
+
+    def get(self, request):
+        """
+        It expects:
+        - GET as http method;
+
+        It returns:
+        - HTTP status = 200;
+        - A JSON like this:
+            {
+                "client": {"hits": 120, "misses": 8, "hit_rate": 0.9375},
+                "referrals": {"hits": 560, "misses": 40, "hit_rate": 0.9333}
+            }
+        """
+
+        logger.info("Received a request to fetch the cache counters.")
+        return Response({'client': client_cache.stats(), 'referrals': referral_cache.stats()},
+                        status=status.HTTP_200_OK)
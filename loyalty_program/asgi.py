@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'loyalty_program.settings')
 
 application = get_asgi_application()
+
+from loyalty_program.apps.referral.apps import start_background_jobs  # noqa: E402
+
+start_background_jobs()
@@ -82,9 +82,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # the tests run on a database file, not in memory, so the concurrency
+        # tests can open one connection per thread on the same database
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Pragmas run on every new SQLite connection (see
+# loyalty_program/apps/referral/database.py), and the retries, with
+# exponential backoff from SQLITE_LOCK_BACKOFF seconds, of the writes that
+# find the database locked. Compare them with the SQLite defaults with
+# `python manage.py benchmark_sqlite`.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 2 ** 20,
+    'cache_size': -64000,
+    'temp_store': 'MEMORY',
+}
+
+SQLITE_LOCK_RETRIES = 5
+
+SQLITE_LOCK_BACKOFF = 0.05
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -130,6 +154,83 @@ STATIC_URL = '/static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Expired referrals sweeping. Set REFERRAL_SWEEP_INTERVAL (in seconds) to run
+# the in-process sweeper on the processes that serve requests, or leave it as
+# None and schedule `python manage.py expire_referrals` instead. The sweep
+# lock lasts REFERRAL_SWEEP_LOCK_TTL seconds, and is extended after each chunk.
+
+REFERRAL_SWEEP_INTERVAL = None
+
+REFERRAL_SWEEP_LOCK_TTL = 300
+
+
+# Default number of referrals per page on the listings (cursor pagination),
+# can be changed per request with the 'page_size' query parameter.
+
+REFERRAL_PAGE_SIZE = 50
+
+# Rows fetched from the database at a time on the streamed export
+# (/all-referrals/?stream=1).
+
+REFERRAL_STREAM_CHUNK_SIZE = 2000
+
+# Maximum number of items on a bulk request (/accept-referrals/,
+# /create-referrals/ and /users/). Their CPFs are looked up with one IN
+# list, which must stay below the 999 variables SQLite (before 3.32) allows.
+
+REFERRAL_BULK_MAX_ITEMS = 500
+
+CLIENT_BULK_MAX_ITEMS = 500
+
+
+# Size of the in-process cached leaderboard (/leaderboard/), and the seconds
+# after which it is reloaded, to see the points credited by other processes.
+
+LEADERBOARD_SIZE = 100
+
+LEADERBOARD_TTL = 60
+
+
+# Cache of the clients served by /user/<cpf>/. Any django cache backend can
+# be set on CACHES (like memcached or redis, shared by every process);
+# CLIENT_CACHE_TIMEOUT (in seconds) bounds how long a client changed by
+# another process (or by a management command) may be served from a
+# process-local cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+CLIENT_CACHE_ALIAS = 'default'
+
+CLIENT_CACHE_TIMEOUT = 300
+
+# Cache of the responses of /all-referrals/ and /referral/<cpf>/. They are
+# versioned by generations kept on the database, so a write invalidates them
+# on every process, even with a process-local cache like locmem.
+
+REFERRAL_CACHE_ALIAS = 'default'
+
+REFERRAL_CACHE_TIMEOUT = 300
+
+# For how many seconds the response to an Idempotency-Key (POST /user/ and
+# /create-referral/) can be replayed. The responses are kept on the
+# database, so they are shared by every process and never evicted early.
+
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+
+# In-memory membership filters of the client and referred CPFs (see
+# loyalty_program/apps/referral/membership.py): expected number of CPFs and
+# false positive rate up to it.
+
+MEMBERSHIP_FILTER_CAPACITY = 1000000
+
+MEMBERSHIP_FILTER_ERROR_RATE = 0.01
+
+
 # Adding logging to project
 LOGGING = {
     "version": 1,
@@ -14,21 +14,30 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, register_converter
 
 from loyalty_program.apps.referral.views import (AcceptReferralView, 
-    CreateReferralView, GetReferralView, GetUserReferralsView, 
+    BulkAcceptReferralsView, BulkCreateReferralsView, BulkCreateUsersView, CacheStatsView, ClientRankView, CreateReferralView, LeaderboardView, GetReferralView, GetUserReferralsView, 
     UpdateUserView, GetReferralsView, MainPage, CreateUserView)
+from loyalty_program.apps.referral.converters import CPFConverter
+
+register_converter(CPFConverter, 'cpf')
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', MainPage.as_view()),
     path('user/', CreateUserView.as_view()),
-    path('user/<str:cpf>/', UpdateUserView.as_view()),
+    path('user/<cpf:cpf>/', UpdateUserView.as_view()),
+    path('users/', BulkCreateUsersView.as_view()),
     path('all-referrals/', GetReferralsView.as_view()),
-    path('all-referrals/<str:cpf>/', GetUserReferralsView.as_view()),
-    path('referral/<str:cpf>/', GetReferralView.as_view()),
+    path('all-referrals/<cpf:cpf>/', GetUserReferralsView.as_view()),
+    path('referral/<cpf:cpf>/', GetReferralView.as_view()),
     path('create-referral/', CreateReferralView.as_view()),
-    path('accept-referral/<str:cpf>/', AcceptReferralView.as_view()),
+    path('create-referrals/', BulkCreateReferralsView.as_view()),
+    path('accept-referral/<cpf:cpf>/', AcceptReferralView.as_view()),
+    path('accept-referrals/', BulkAcceptReferralsView.as_view()),
+    path('leaderboard/', LeaderboardView.as_view()),
+    path('leaderboard/<cpf:cpf>/', ClientRankView.as_view()),
+    path('cache-stats/', CacheStatsView.as_view()),
 ]